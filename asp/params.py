@@ -10,9 +10,36 @@
 # primary=['asp/tk/speed_revamp.lp', 'asp/tk/tracks.lp']
 # primary=['asp/tk/tracks_trajectories.lp', 'asp/tk/trajectory_encoding.lp']
 primary=['asp/tk/encoding_incremental.lp', 'asp/tk/tracks_incremental.lp']
+# cell_conn/5 computed in Python, run with --precomputed-conn always
+# primary=['asp/tk/encoding_incremental.lp', 'asp/tk/tracks_precomputed.lp']
+# plans on contracted corridors, run with --segments
+# primary=['asp/tk/encoding_segments.lp']
+# transitions restricted to per-train reachability windows, run with --reachability horizon
+# primary=['asp/tk/encoding_incremental_reach.lp', 'asp/tk/tracks_incremental.lp']
+# primary=['asp/tk/speed_revamp_reach.lp', 'asp/tk/tracks.lp']
 # primary=['asp/tk/encoding_incremental_cond_conn.lp', 'asp/tk/tracks_incremental_cond_conn.lp']
 # primary=['asp/tk/encoding.lp', 'asp/tk/tracks.lp']
 primary=['asp/tk/speed_revamp.lp', 'asp/tk/tracks.lp']
 # primary=['asp/tk/encoding_transition.lp', 'asp/tk/tracks_transition.lp']
 
-secondary=[]
\ No newline at end of file
+secondary=[]
+
+# number of solver threads (None keeps clingo's default of 1) and how they share the work: 'compete' or 'split'
+threads=None
+parallel_mode='compete'
+# portfolio mode (solve_incremental.py --portfolio): all members run in parallel, the first valid plan wins
+# name:         label used in the statistics
+# primary:      encodings of the member
+# incremental:  solved with IncrementalFlatlandPlan if True, FlatlandPlan otherwise
+# arguments:    additional clingo options, e.g. a search configuration
+# plan_options: keyword arguments of IncrementalFlatlandPlan / FlatlandPlan
+portfolio=[
+    {"name": "incremental", "primary": ['asp/tk/encoding_incremental.lp', 'asp/tk/tracks_incremental.lp'], "incremental": True,
+     "arguments": [], "plan_options": {"lower_bound": True}},
+    {"name": "incremental-reach-frumpy", "primary": ['asp/tk/encoding_incremental_reach.lp', 'asp/tk/tracks_incremental.lp'], "incremental": True,
+     "arguments": ['--configuration=frumpy'], "plan_options": {"lower_bound": True, "reachability": "horizon"}},
+    {"name": "segments", "primary": ['asp/tk/encoding_segments.lp'], "incremental": True,
+     "arguments": [], "plan_options": {"lower_bound": True, "segments": True}},
+    {"name": "segments-binary-crafty", "primary": ['asp/tk/encoding_segments.lp'], "incremental": True,
+     "arguments": ['--configuration=crafty'], "plan_options": {"segments": True, "horizon": "binary"}},
+]
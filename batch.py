@@ -0,0 +1,157 @@
+# standard packages
+import os
+import glob
+import json
+import time
+import pickle
+import warnings
+import multiprocessing as mp
+from queue import Empty
+from argparse import ArgumentParser, Namespace
+
+# custom modules
+from asp import params
+from modules.api import FACT_LOADERS, HORIZON_STRATEGIES, DEADLINES, PARALLEL_MODES
+from modules.portfolio import run_member
+
+
+def find_envs(patterns) -> list:
+    """ all environment .pkl files matching the given paths or glob patterns, in order and without duplicates """
+    paths = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            if path not in paths:
+                paths.append(path)
+    return(paths)
+
+
+def finished_envs(output) -> set:
+    """ paths of the environments that already have a row in the results file """
+    if not os.path.exists(output):
+        return(set())
+    with open(output) as f:
+        return({json.loads(line)["env"] for line in f if line.strip()})
+
+
+def load_env(path):
+    """ load a pickled environment, None if it was pickled with an incompatible Flatland version """
+    try:
+        return(pickle.load(open(path, "rb")))
+    except (ModuleNotFoundError, AttributeError) as e:
+        warnings.warn(f"Skipping environment '{path}': {e}")
+        return(None)
+
+
+def run_batch(paths, member, output, workers=1, timeout=None, quiet=True) -> list:
+    """
+    plan every environment in its own process, with at most `workers` processes at a time
+    a job that runs for longer than `timeout` seconds is killed
+    one row per environment is appended to the JSONL file `output` as soon as the job has finished, the rows are returned as well
+    """
+    queue = mp.Queue()
+    pending = list(paths)
+    running = {}
+    rows = []
+
+    def write(row):
+        rows.append(row)
+        with open(output, "a") as f:
+            f.write(json.dumps(row, default=str) + "\n")
+        print(f"[{len(rows)}/{len(paths)}] {row['env']}: {row['status']} after {row['seconds']:.2f} seconds")
+
+    while pending or running:
+        # start new jobs while workers are free
+        while pending and len(running) < workers:
+            path = pending.pop(0)
+            env = load_env(path)
+            if env is None:
+                write({"env": path, "name": member["name"], "status": "error", "seconds": 0.0, "steps": None, "stats": {"error": "could not load environment"}})
+                continue
+            p = mp.Process(target=run_member, args=(dict(member, name=path), env, queue, quiet), daemon=True)
+            p.start()
+            running[path] = (p, time.time())
+        if not running:
+            continue
+
+        # wait for the next result, but no longer than until the earliest timeout, and check for crashed jobs every second
+        wait = 1.0
+        if timeout is not None:
+            wait = max(0, min(wait, min(start for _, start in running.values()) + timeout - time.time()))
+        try:
+            path, status, seconds, actions, stats, _ = queue.get(timeout=wait)
+        except Empty:
+            path = None
+        # results of jobs that were killed just after finishing are dropped, the timeout has been recorded already
+        if path in running:
+            p, _ = running.pop(path)
+            p.join()
+            write({"env": path, "name": member["name"], "status": status, "seconds": round(seconds, 2),
+                   "steps": len(actions) if actions else None, "stats": stats})
+
+        # a job that exits with an error code died before it could put its result on the queue
+        for path, (p, start) in list(running.items()):
+            if p.exitcode not in (None, 0):
+                del running[path]
+                write({"env": path, "name": member["name"], "status": "error", "seconds": round(time.time() - start, 2), "steps": None, "stats": {"error": f"exit code {p.exitcode}"}})
+
+        # kill jobs that ran out of time
+        # (clingo turns SIGTERM into an interrupted solve call and keeps going, so the jobs are killed)
+        for path, (p, start) in list(running.items()):
+            if timeout is not None and time.time() - start >= timeout:
+                p.kill()
+                p.join()
+                del running[path]
+                write({"env": path, "name": member["name"], "status": "timeout", "seconds": round(time.time() - start, 2), "steps": None, "stats": None})
+    return(rows)
+
+
+def get_args():
+    """ capture command line inputs """
+    parser = ArgumentParser()
+    parser.add_argument('-e', '--envs', type=str, nargs='+', default=['envs/pkl/*.pkl'], help='environment .pkl files or glob patterns')
+    parser.add_argument('-p', '--primary', type=str, nargs='+', default=params.primary, help='encodings to solve with (defaults to asp/params.py)')
+    parser.add_argument('-o', '--output', type=str, default='output/batch.jsonl', help='JSONL file the results are appended to')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='number of environments solved at the same time (defaults to the number of CPUs)')
+    parser.add_argument('--timeout', type=float, default=None, help='seconds after which a job is killed and recorded as a timeout')
+    parser.add_argument('--resume', action='store_true', default=False, help='if included, skip environments that already have a row in the output file')
+    parser.add_argument('--verbose', action='store_true', default=False, help='if included, show the output of the solver processes')
+    parser.add_argument('-i', '--incremental', action='store_true', default=False, help='if included, use the incremental solving approach')
+    parser.add_argument('-io', '--incremental-optimize', action='store_true', default=False, help='if included, run the \'optimize\' subprogram after establishing the minimum time horizon')
+    parser.add_argument('--opt-budget', type=float, default=None, help='seconds after which the optimization stops and keeps the best plan found so far')
+    parser.add_argument('--lower-bound', action='store_true', default=False, help='if included, start the incremental loop at a lower bound on the makespan')
+    parser.add_argument('--horizon', type=str, choices=HORIZON_STRATEGIES, default='linear', help='how the incremental loop searches for the first satisfiable step')
+    parser.add_argument('--fact-loader', type=str, choices=FACT_LOADERS, default='backend', help='how environment facts are passed to clingo')
+    parser.add_argument('--segments', action='store_true', default=False, help='if included, contract corridors into segments and plan on them (use with asp/tk/encoding_segments.lp)')
+    parser.add_argument('--reachability', type=str, choices=DEADLINES, default=None, help='add per-train reachability windows with the given deadline')
+    parser.add_argument('-t', '--threads', type=int, default=getattr(params, 'threads', None), help='number of solver threads per job (defaults to params.threads)')
+    parser.add_argument('--parallel-mode', type=str, choices=PARALLEL_MODES, default=getattr(params, 'parallel_mode', 'compete'), help='whether solver threads compete on or split the search space')
+    return(parser.parse_args())
+
+
+def main():
+    args: Namespace = get_args()
+    incremental = args.incremental or args.incremental_optimize
+    plan_options = {"fact_loader": args.fact_loader, "segments": args.segments, "reachability": args.reachability,
+                    "threads": args.threads, "parallel_mode": args.parallel_mode}
+    if incremental:
+        plan_options.update(optimize=args.incremental_optimize, opt_budget=args.opt_budget, lower_bound=args.lower_bound, horizon=args.horizon)
+    member = {"name": "incremental" if incremental else "plan", "primary": args.primary, "incremental": incremental, "plan_options": plan_options}
+
+    paths = find_envs(args.envs)
+    if args.resume:
+        done = finished_envs(args.output)
+        paths = [path for path in paths if path not in done]
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    print(f"Solving {len(paths)} environments with {args.workers} workers.")
+
+    start_time = time.time()
+    rows = run_batch(paths, member, args.output, workers=args.workers, timeout=args.timeout, quiet=not args.verbose)
+    counts = {}
+    for row in rows:
+        counts[row["status"]] = counts.get(row["status"], 0) + 1
+    print(f"Batch finished in {time.time() - start_time:.2f} seconds: {', '.join(f'{n} {s}' for s, n in counts.items())}.")
+
+
+if __name__ == "__main__":
+    main()
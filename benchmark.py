@@ -0,0 +1,463 @@
+# standard packages
+import os
+import warnings
+import glob
+import time
+import pickle
+import io
+import sys
+import copy
+import json
+import resource
+import tempfile
+import multiprocessing as mp
+from queue import Empty
+from argparse import ArgumentParser, Namespace
+
+# custom modules
+from asp import params
+from modules.convert import convert_to_clingo, write_clingo, convert_formers_to_assumptions, convert_malfunctions_to_assumptions
+from modules.api import add_env, compact_statistics, FlatlandPlan, FlatlandReplan, IncrementalFlatlandPlan, FACT_LOADERS, PARALLEL_MODES, WARM_STARTS
+from modules.transitions import WAIT_POLICIES
+from modules.actionlist import ACTION_NAMES, NO_ACTION
+from html_viz import grid_json, train_info, LandscapeBuilder, generate_html
+
+# clingo
+import clingo
+from clingo.application import clingo_main
+
+import numpy as np
+from flatland.envs.malfunction_generators import MalfunctionParameters, ParamMalfunctionGen
+
+
+def convert_to_clingo_loop(env) -> str:
+    """
+    reference: the original per-cell conversion, growing one string with +=
+    """
+    rail_map = env.rail.grid
+    height, width, agents = env.height, env.width, env.agents
+    clingo_str = f"% clingo representation of a Flatland environment\n% height: {height}, width: {width}, agents: {len(agents)}\n"
+    clingo_str += f"\nglobal({env._max_episode_steps}).\n"
+
+    dir_map = {0:"n", 1:"e", 2:"s", 3:"w"}
+    for agent_num, agent_info in enumerate(env.agents):
+        init_y, init_x = agent_info.initial_position
+        goal_y, goal_x = agent_info.target
+        min_start, max_end = agent_info.earliest_departure, agent_info.latest_arrival
+        try:
+            speed = int(1/agent_info.speed_counter.speed)
+        except ZeroDivisionError:
+            speed = 0
+        direction = dir_map[agent_info.initial_direction]
+        clingo_str += f"\ntrain({agent_num}). "
+        clingo_str += f"start({agent_num},({init_y},{init_x}),{min_start},{direction}). "
+        clingo_str += f"end({agent_num},({goal_y},{goal_x}),{max_end}). "
+        clingo_str += f"speed({agent_num},{speed}).\n"
+
+    clingo_str += "\n"
+    for row, row_array in enumerate(rail_map):
+        for col, cval in enumerate(row_array):
+            clingo_str += f"cell(({row},{col}), {cval}).\n"
+        clingo_str+="\n"
+    return(clingo_str)
+
+
+def timed(func, repeat) -> float:
+    """ best wall-clock time of `repeat` calls of func, in milliseconds """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return(best)
+
+
+def bench_convert(envs, repeat) -> list:
+    """ compare the original loop converter with the numpy writer (dense and sparse) """
+    rows = []
+    for name, env in envs:
+        row = {"env": name, "size": f"{env.height}x{env.width}"}
+        row["loop_ms"] = timed(lambda: convert_to_clingo_loop(env), repeat)
+        row["dense_ms"] = timed(lambda: convert_to_clingo(env, skip_empty=False), repeat)
+        row["sparse_ms"] = timed(lambda: write_clingo(env, io.StringIO(), skip_empty=True), repeat)
+        row["dense_facts"] = convert_to_clingo(env, skip_empty=False).count("cell(")
+        row["sparse_facts"] = convert_to_clingo(env, skip_empty=True).count("cell(")
+        rows.append(row)
+    return(rows)
+
+
+def bench_facts(envs, repeat, files) -> list:
+    """ compare adding the environment as parsed text with adding it through the clingo backend, up to grounding the base program """
+    rows = []
+    for name, env in envs:
+        row = {"env": name, "size": f"{env.height}x{env.width}"}
+        for fact_loader in FACT_LOADERS:
+            add_times, ground_times = [], []
+            for _ in range(repeat):
+                ctl = clingo.Control()
+                for f in files:
+                    ctl.load(f)
+                start = time.perf_counter()
+                add_env(ctl, env, fact_loader)
+                added = time.perf_counter()
+                ctl.ground([("base", [])])
+                add_times.append((added - start) * 1000)
+                ground_times.append((time.perf_counter() - added) * 1000)
+            row[f"{fact_loader}_add_ms"] = min(add_times)
+            row[f"{fact_loader}_ground_ms"] = min(ground_times)
+        rows.append(row)
+    return(rows)
+
+
+def ground_base(files, env, fact_loader, precomputed_conn=None) -> tuple:
+    """ ground the base program, returns (milliseconds, number of symbolic atoms, number of rules) """
+    ctl = clingo.Control(["--warn=none"])
+    for f in files:
+        ctl.load(f)
+    start = time.perf_counter()
+    add_env(ctl, env, fact_loader, precomputed_conn)
+    ctl.ground([("base", [])])
+    elapsed = (time.perf_counter() - start) * 1000
+    atoms = len(ctl.symbolic_atoms)
+    # rule counts are only collected during preprocessing, i.e. when solving
+    ctl.solve(assumptions=[(clingo.Function("__benchmark"), True)])
+    rules = int(ctl.statistics["problem"]["lp"]["rules"])
+    return(elapsed, atoms, rules)
+
+
+def bench_conn(envs, repeat, files, wait, fact_loader) -> list:
+    """ compare deriving cell_conn/5 with the tracks*.lp join against precomputing it in Python """
+    precomputed_files = [f for f in files if "tracks" not in os.path.basename(f)] + ["asp/tk/tracks_precomputed.lp"]
+    rows = []
+    for name, env in envs:
+        row = {"env": name, "size": f"{env.height}x{env.width}"}
+        for label, fs, conn in [("join", files, None), ("precomputed", precomputed_files, wait)]:
+            results = [ground_base(fs, env, fact_loader, conn) for _ in range(repeat)]
+            row[f"{label}_ms"] = min(r[0] for r in results)
+            row[f"{label}_atoms"] = results[0][1]
+            row[f"{label}_rules"] = results[0][2]
+        rows.append(row)
+    return(rows)
+
+
+def bench_threads(envs, files, threads, parallel_mode, optimize=False) -> list:
+    """ solve each environment incrementally with every thread count, with the speedup of each phase over the first thread count """
+    rows = []
+    for name, env in envs:
+        base = None
+        for t in threads:
+            app = IncrementalFlatlandPlan(copy.deepcopy(env), None, optimize=optimize, lower_bound=True, threads=t, parallel_mode=parallel_mode)
+            start = time.perf_counter()
+            clingo_main(app, files + ["--outf=3"])
+            phases = dict(app.stats["phases"], total=time.perf_counter() - start)
+            base = phases if base is None else base
+            row = {"env": name, "threads": t, "mode": parallel_mode, "steps": len(app.action_list) if app.action_list else None}
+            for phase, seconds in phases.items():
+                if phase == "optimize" and not optimize:
+                    continue
+                row[f"{phase}_ms"] = seconds * 1000
+                row[f"{phase}_speedup"] = base[phase] / seconds if seconds > 0 else float("nan")
+            rows.append(row)
+    return(rows)
+
+
+# collision constraint grounded for all pairs of trains, or checked by the OccupancyPropagator
+COLLISION_VARIANTS = [("grounded", ["asp/tk/encoding_incremental.lp", "asp/tk/tracks_incremental.lp"], False),
+                      ("propagator", ["asp/tk/encoding_incremental_propagator.lp", "asp/tk/tracks_incremental.lp"], True)]
+
+
+def bench_propagator(envs) -> list:
+    """ solve each environment incrementally with the grounded collision constraint and with the OccupancyPropagator """
+    rows = []
+    for name, env in envs:
+        for label, files, propagator in COLLISION_VARIANTS:
+            app = IncrementalFlatlandPlan(copy.deepcopy(env), None, lower_bound=True, propagator=propagator)
+            start = time.perf_counter()
+            clingo_main(app, files + ["--outf=3"])
+            summary = app.stats["incremental"]["stats"]
+            rows.append({"env": name, "mode": label, "steps": len(app.action_list) if app.action_list else None,
+                         "ground_ms": app.stats["phases"]["ground"] * 1000, "solve_ms": app.stats["phases"]["solve"] * 1000,
+                         "total_ms": (time.perf_counter() - start) * 1000, "atoms": summary["atoms"], "rules": summary["rules"],
+                         "conflicts": app.occupancy.conflicts if app.occupancy is not None else None})
+    return(rows)
+
+
+def plan_distance(old, new, start) -> int:
+    """ number of (timestep, train) pairs from timestep `start` on at which two action matrices differ, missing timesteps count as no action """
+    length = max(len(old), len(new))
+    padded = [np.pad(m.matrix, ((0, length - len(m)), (0, 0)), constant_values=NO_ACTION) for m in (old, new)]
+    return(int((padded[0][start:] != padded[1][start:]).sum()))
+
+
+def bench_warm_start(envs, files, incremental=False, malfunctions=None) -> list:
+    """
+    run each environment with its malfunctions and replan after every new one, once without and once with every warm start
+    all replanners get the same assumptions, the simulation goes on with the plan found without warm start
+    `malfunctions` (rate, min duration, max duration) replaces the malfunction generator of the environments
+    """
+    rows = []
+    modes = [None] + WARM_STARTS
+    for name, env in envs:
+        env = copy.deepcopy(env)
+        if malfunctions is not None:
+            rate, low, high = malfunctions
+            env.malfunction_generator = ParamMalfunctionGen(MalfunctionParameters(malfunction_rate=rate, min_duration=low, max_duration=high))
+        app = IncrementalFlatlandPlan(env, None, lower_bound=True) if incremental else FlatlandPlan(env, None)
+        clingo_main(app, files + ["--outf=3"])
+        actions = app.action_list
+        if actions is None:
+            warnings.warn(f"Skipping environment '{name}': no initial plan")
+            continue
+        replanners = {mode: FlatlandReplan(env, files, incremental=incremental, warm_start=mode) for mode in modes}
+        results = {mode: {"replans": 0, "failed": 0, "solve_ms": 0.0, "changed": 0} for mode in modes}
+        # train -> remaining timesteps of its malfunction, as in the MalfunctionManager of solve_incremental.py
+        broken = {}
+        timestep = 0
+        while timestep < len(actions):
+            _, _, done, info = env.step(actions[timestep])
+            if done["__all__"]:
+                break
+            new = {train: d for train, d in info["malfunction"].items() if d > 0 and train not in broken}
+            broken.update(new)
+            if new:
+                context = convert_formers_to_assumptions(actions[:timestep]) + convert_malfunctions_to_assumptions(list(broken.items()), timestep)
+                plans = {}
+                for mode, replanner in replanners.items():
+                    plans[mode] = replanner.replan(context, horizon=len(actions), hints=actions)
+                    result = results[mode]
+                    result["replans"] += 1
+                    result["solve_ms"] += float(replanner.stats[-1]["solve_time"]) * 1000
+                    if plans[mode] is None:
+                        result["failed"] += 1
+                    else:
+                        result["changed"] += plan_distance(actions, plans[mode], timestep + 1)
+                if plans[None] is not None:
+                    actions = plans[None]
+            broken = {train: d - 1 for train, d in broken.items() if d > 1}
+            timestep += 1
+        cold = results[None]["solve_ms"]
+        for mode, result in results.items():
+            rows.append(dict({"env": name, "mode": mode or "cold"}, **result,
+                             speedup=cold / result["solve_ms"] if result["solve_ms"] > 0 else float("nan")))
+    return(rows)
+
+
+def simulate(env, actions) -> tuple:
+    """ run the plan on the environment without malfunctions, returns the train info of the HTML visualization and the number of timesteps """
+    dir_map = {0:'n', 1:'e', 2:'s', 3:'w'}
+    train_dict = train_info(env)
+    timestep = 0
+    for timestep, step in enumerate(actions):
+        for a, action in step.items():
+            agent = env.agents[a]
+            train_dict[a]["path"][timestep] = {
+                "position": {"x": int(agent.position[1]), "y": int(agent.position[0])} if agent.position is not None else None,
+                "direction": dir_map[agent.direction],
+                "status": agent.state.name,
+                "action": ACTION_NAMES[action.value]
+            }
+        _, _, done, _ = env.step(step)
+        if done["__all__"]:
+            break
+    return(train_dict, timestep + 1)
+
+
+def render_html(env, name, train_dict, timesteps) -> str:
+    """ generate the HTML visualization of a simulated plan in a temporary directory """
+    with tempfile.TemporaryDirectory() as base_dir:
+        with open(os.path.join(base_dir, "train_info.json"), "w") as f:
+            json.dump(train_dict, f)
+        with open(os.path.join(base_dir, "grid.json"), "w") as f:
+            json.dump(grid_json(env), f)
+        landscape = LandscapeBuilder(base_dir, timesteps, cell_size=20)
+        return(generate_html(name, landscape, milliseconds_per_step=int(30000 / timesteps)))
+
+
+# columns of a pipeline row, times are in milliseconds
+PIPELINE_COLUMNS = ["env", "encoding", "status", "steps", "convert_ms", "ground_ms", "solve_ms", "simulate_ms", "html_ms", "atoms", "rules", "peak_rss_mb"]
+
+
+def run_pipeline(member, name, env, queue, quiet=True) -> None:
+    """
+    convert, ground, solve, simulate and render one environment with one encoding and put the row on the queue
+    runs in its own process, so that the peak RSS belongs to this environment and encoding only
+    """
+    if quiet:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+    row = dict.fromkeys(PIPELINE_COLUMNS)
+    row.update(env=name, encoding=member["name"])
+    try:
+        row["convert_ms"] = timed(lambda: convert_to_clingo(env, skip_empty=True), 1)
+        incremental = member.get("incremental", True)
+        options = member.get("plan_options", {})
+        if incremental:
+            app = IncrementalFlatlandPlan(copy.deepcopy(env), None, **options)
+        else:
+            app = FlatlandPlan(copy.deepcopy(env), None, **options)
+        clingo_main(app, member["primary"] + member.get("arguments", []) + ["--outf=3"])
+        phases = app.stats["phases"] if incremental else app.phases
+        row["ground_ms"] = phases["ground"] * 1000
+        row["solve_ms"] = (phases["solve"] + phases.get("optimize", 0.0)) * 1000
+        stats = app.stats["incremental"]["stats"] if incremental else app.stats
+        # incremental members keep the full statistics tree only with full_stats in their plan_options
+        summary = compact_statistics(stats) if "problem" in stats else stats
+        row["atoms"], row["rules"] = summary["atoms"], summary["rules"]
+        if app.action_list:
+            row["steps"] = len(app.action_list)
+            start = time.perf_counter()
+            train_dict, timesteps = simulate(copy.deepcopy(env), app.action_list)
+            row["simulate_ms"] = (time.perf_counter() - start) * 1000
+            row["html_ms"] = timed(lambda: render_html(env, name, train_dict, timesteps), 1)
+            row["status"] = "ok"
+        else:
+            row["status"] = "no plan"
+    except Exception as e:
+        row["status"] = f"error: {e!r}"
+    # ru_maxrss is given in kilobytes on Linux
+    row["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put(row)
+
+
+def bench_pipeline(envs, members, quiet=True) -> list:
+    """ run every environment end to end through every encoding of the portfolio, one process at a time """
+    rows = []
+    for name, env in envs:
+        for member in members:
+            queue = mp.Queue()
+            p = mp.Process(target=run_pipeline, args=(member, name, env, queue, quiet))
+            p.start()
+            row = None
+            while row is None:
+                # a process that dies without putting its row (e.g. killed for running out of memory) would block queue.get forever
+                exited = p.exitcode is not None
+                try:
+                    row = queue.get(timeout=1)
+                except Empty:
+                    if exited:
+                        break
+            p.join()
+            if row is None:
+                row = dict.fromkeys(PIPELINE_COLUMNS)
+                row.update(env=name, encoding=member["name"], status=f"error: exit code {p.exitcode}")
+            rows.append(row)
+    return(rows)
+
+
+# columns that identify a row, and the measurements that are compared against a baseline (for all of them lower is better)
+KEY_COLUMNS = ("env", "size", "encoding", "threads", "mode")
+REGRESSION_SUFFIXES = ("_ms", "_mb")
+
+
+def compare_baseline(rows, baseline, threshold) -> list:
+    """
+    compare the measurements of each row with the row of the baseline that has the same key columns
+    returns the regressions as dicts with the row key, the column, both values and the relative change
+    """
+    def key(row):
+        return(tuple((c, row[c]) for c in KEY_COLUMNS if c in row))
+
+    previous = {key(row): row for row in baseline}
+    regressions = []
+    for row in rows:
+        base = previous.get(key(row))
+        if base is None:
+            continue
+        for column, value in row.items():
+            old = base.get(column)
+            if not column.endswith(REGRESSION_SUFFIXES) or not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or old <= 0:
+                continue
+            change = (value - old) / old
+            if change > threshold:
+                regressions.append({"key": " ".join(str(v) for _, v in key(row)), "column": column, "baseline": old, "current": value, "change": f"{change:+.0%}"})
+    return(regressions)
+
+
+def print_table(rows) -> None:
+    """ print a list of result dicts as an aligned table """
+    if not rows:
+        print("No results.")
+        return
+    columns = list(rows[0].keys())
+    cells = [[f"{row[c]:.2f}" if isinstance(row[c], float) else str(row[c]) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in cells:
+        print("  ".join(v.ljust(w) for v, w in zip(r, widths)))
+
+
+def load_envs(patterns) -> list:
+    """ load all environments matching the given paths or glob patterns """
+    envs = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            name = os.path.basename(path)[:-4]
+            try:
+                envs.append((name, pickle.load(open(path, "rb"))))
+            except (ModuleNotFoundError, AttributeError) as e:
+                # pickled with an incompatible Flatland version
+                warnings.warn(f"Skipping environment '{path}': {e}")
+    return(envs)
+
+
+def get_args():
+    """ capture command line inputs """
+    parser = ArgumentParser()
+    parser.add_argument('mode', type=str, choices=['convert', 'facts', 'conn', 'threads', 'pipeline', 'propagator', 'warmstart'], help='which part of the pipeline to benchmark')
+    parser.add_argument('-e', '--envs', type=str, nargs='+', default=['envs/pkl/*.pkl'], help='environment .pkl files or glob patterns')
+    parser.add_argument('-p', '--primary', type=str, nargs='+', default=params.primary, help='encodings to ground (defaults to asp/params.py)')
+    parser.add_argument('-w', '--wait', type=str, choices=WAIT_POLICIES, default='always', help='wait policy of the precomputed cell_conn facts (conn mode)')
+    parser.add_argument('-f', '--fact-loader', type=str, choices=FACT_LOADERS, default='backend', help='how environment facts are passed to clingo (conn mode)')
+    parser.add_argument('-t', '--threads', type=int, nargs='+', default=[1, 2, 4], help='thread counts to compare (threads mode), speedups are relative to the first one')
+    parser.add_argument('--parallel-mode', type=str, choices=PARALLEL_MODES, default='compete', help='parallel mode of the solver threads (threads mode)')
+    parser.add_argument('-o', '--optimize', action='store_true', default=False, help='if included, also run the optimize program (threads mode)')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='number of repetitions per measurement (the best one is reported)')
+    parser.add_argument('-m', '--members', type=str, nargs='+', default=None, help='names of the params.portfolio encodings to run (pipeline mode, defaults to all)')
+    parser.add_argument('-i', '--incremental', action='store_true', default=False, help='if included, plan and replan with the incremental approach (warmstart mode)')
+    parser.add_argument('--malfunctions', type=float, nargs=3, default=None, metavar=('RATE', 'MIN', 'MAX'), help='replace the malfunctions of the environments by this rate and duration range (warmstart mode)')
+    parser.add_argument('--verbose', action='store_true', default=False, help='if included, show the solver output (pipeline mode)')
+    parser.add_argument('--save', type=str, default=None, help='write the results to this JSON file')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON file of an earlier run (see --save) to compare the results with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown over the baseline that counts as a regression')
+    return(parser.parse_args())
+
+
+def main():
+    args: Namespace = get_args()
+    envs = load_envs(args.envs)
+    if args.mode == 'convert':
+        rows = bench_convert(envs, args.repeat)
+    elif args.mode == 'facts':
+        rows = bench_facts(envs, args.repeat, args.primary)
+    elif args.mode == 'conn':
+        rows = bench_conn(envs, args.repeat, args.primary, args.wait, args.fact_loader)
+    elif args.mode == 'threads':
+        rows = bench_threads(envs, args.primary, args.threads, args.parallel_mode, args.optimize)
+    elif args.mode == 'pipeline':
+        members = [m for m in params.portfolio if args.members is None or m["name"] in args.members]
+        rows = bench_pipeline(envs, members, quiet=not args.verbose)
+    elif args.mode == 'propagator':
+        rows = bench_propagator(envs)
+    elif args.mode == 'warmstart':
+        malfunctions = (args.malfunctions[0], int(args.malfunctions[1]), int(args.malfunctions[2])) if args.malfunctions else None
+        rows = bench_warm_start(envs, args.primary, args.incremental, malfunctions)
+    print_table(rows)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"mode": args.mode, "rows": rows}, f, indent=4)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["mode"] != args.mode:
+            raise ValueError(f"Baseline '{args.baseline}' was recorded in {baseline['mode']} mode, not {args.mode} mode")
+        regressions = compare_baseline(rows, baseline["rows"], args.threshold)
+        print(f"\n{len(regressions)} regressions over {args.threshold:.0%} compared to '{args.baseline}'.")
+        if regressions:
+            print_table(regressions)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
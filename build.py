@@ -4,7 +4,6 @@ from argparse import ArgumentParser, Namespace
 # custom modules
 from modules.dirs import create_dirs, find_start
 from modules.save import save_lp, save_png, save_pkl
-from modules.convert import convert_to_clingo
 
 # Flatland modules
 from flatland.envs.rail_env import RailEnv
@@ -102,7 +101,7 @@ def main():
 
             # save files
             file_name = f"env_{i:03d}--{params.number_of_agents}_{params.max_num_cities}"
-            save_lp(convert_to_clingo(env), file_name, path)
+            save_lp(env, file_name, path)
             save_png(env, file_name, path)
             save_pkl(env, file_name, path)
             
@@ -1,51 +1,62 @@
-from flatland.envs.rail_env import RailEnv
+import numpy as np
 from flatland.envs.rail_env import RailEnvActions
-from flatland.utils.rendertools import RenderTool, AgentRenderVariant
-from modules.convert import convert_actions_to_flatland
 
-def to_dicts(action_list):
+# clingo action names and the RailEnvActions stored for them in an action matrix
+ACTIONS = {"move_forward":RailEnvActions.MOVE_FORWARD, "move_right":RailEnvActions.MOVE_RIGHT, "move_left":RailEnvActions.MOVE_LEFT, "wait":RailEnvActions.STOP_MOVING}
+ACTION_NAMES = {action.value: name for name, action in ACTIONS.items()}
+# entry of an agent that has no action at a timestep
+NO_ACTION = -1
+_RAIL_ACTIONS = {action.value: action for action in RailEnvActions}
+
+
+class ActionMatrix():
     """
-    convert a list of actions to a list of action_dicts
-    this is more consistent with the structure that flatland accepts
+    a plan as a dense int8 array of shape (timesteps, agents) holding the RailEnvActions value of each action, or NO_ACTION
+    indexing with a timestep gives the action dict that env.step expects, slicing gives the plan of a range of timesteps
     """
-    result = []
+    def __init__(self, matrix):
+        self.matrix = matrix
 
-    current_time_step = action_list[0][2]
-    current_dict = {}
+    def __len__(self) -> int:
+        return(self.matrix.shape[0])
 
-    for agent, command, time_step in action_list:
-        if time_step != current_time_step:
-            result.append(current_dict)
-            current_dict = {}
-            current_time_step = time_step
-        
-        current_dict[agent] = command
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return(ActionMatrix(self.matrix[index]))
+        return({agent: _RAIL_ACTIONS[code] for agent, code in enumerate(self.matrix[index].tolist()) if code != NO_ACTION})
 
-    # append the last dictionary after the loop
-    result.append(current_dict)
+    def __iter__(self):
+        for timestep in range(len(self)):
+            yield(self[timestep])
 
-    # replace actions with RailEnvActions
-    mapping = {"move_forward":RailEnvActions.MOVE_FORWARD, "move_right":RailEnvActions.MOVE_RIGHT, "move_left":RailEnvActions.MOVE_LEFT, "wait":RailEnvActions.STOP_MOVING}
-    return(convert_actions_to_flatland(result))
+    def entries(self) -> tuple:
+        """ the arrays (timesteps, agents, codes) of all actions in the plan, ordered by timestep and agent """
+        timesteps, agents = np.nonzero(self.matrix != NO_ACTION)
+        return(timesteps, agents, self.matrix[timesteps, agents])
 
 
-def build_action_list(models):
+def build_action_matrix(model, num_agents, segments=None) -> ActionMatrix:
     """
-    given a model from clingo, build an python action list
+    given a model from clingo, build the action matrix of the plan
+    if the segments of the environment are given, seg_transition atoms are expanded back into per-cell actions
     """
-    action_list = []
-    for func in models[-1]: # only the last model
+    timesteps, agents, codes = [], [], []
+    for func in model:
         func_name = func.name
         if func_name == "action":
-            action = func.arguments[1].name
-            agent, timestep = func.arguments[0], func.arguments[2]
-            agent_num = agent.arguments[0].number
-            action_list.append((agent_num,action,timestep.number))
-            # print(f"Action found: agent {agent_num}, action {action}, timestep {timestep.number}")
-
-    sorted_list = sorted(action_list, key=lambda x: (x[2], x[0]))
-    # dump to temporary file for debugging
-    with open("temp_action_list.txt", "w") as f:
-        for item in sorted_list:
-            f.write(f"{item}\n")
-    return(to_dicts(sorted_list))
\ No newline at end of file
+            agent, action, timestep = func.arguments
+            timesteps.append(timestep.number)
+            agents.append(agent.arguments[0].number)
+            codes.append(ACTIONS[action.name].value)
+        elif func_name == "seg_transition" and segments is not None:
+            agent_num, start, sid, end = (arg.number for arg in func.arguments)
+            segment = segments[sid]
+            # each move along the segment takes the same number of timesteps
+            duration = (end - start) // segment.length
+            timesteps.extend(range(start, start + segment.length * duration))
+            agents.extend([agent_num] * (segment.length * duration))
+            codes.extend(ACTIONS[action].value for action in segment.actions for _ in range(duration))
+
+    matrix = np.full((max(timesteps) + 1 if timesteps else 0, num_agents), NO_ACTION, dtype=np.int8)
+    matrix[timesteps, agents] = codes
+    return(ActionMatrix(matrix))
@@ -2,10 +2,20 @@ import sys
 import pickle
 import io
 import time
+import json
+from dataclasses import dataclass, asdict
+import clingo
 from clingo.symbol import Number, Function
+from clingo.backend import HeuristicType, TruthValue
 from clingo.application import Application, clingo_main
-from modules.convert import convert_to_clingo
-from modules.actionlist import build_action_list
+from modules.convert import convert_to_clingo, load_clingo_facts, convert_formers_to_assumptions
+from modules.transitions import cell_conn_facts, write_cell_conn, load_cell_conn, WAIT_POLICIES
+from modules.segments import build_segments, write_segments, load_segments
+from modules.reachability import reach_windows, write_reach, load_reach, earliest_arrivals, DEADLINES
+from modules.actionlist import build_action_matrix
+from modules.cache import FactCache, GroundProgramCache, cached
+from modules.trace import span
+from modules.propagator import OccupancyPropagator
 import logging
 # logger = logging.getLogger(__name__)
 # logging.basicConfig(level=logging.INFO, format='%(levelname)s -- %(name)s: %(message)s', filename='flatland_api.log', filemode='w')
@@ -20,21 +30,243 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.propagate = False
 
+FACT_LOADERS = ["backend", "text"]
+
+# linear: solve every step until the first satisfiable one
+# exponential: probe steps with growing gaps (k, 2k, 4k, ...) and keep the first satisfiable probe, which may exceed the minimal makespan
+# binary: probe like exponential, then bisect between the last unsatisfiable and the first satisfiable probe for the minimal makespan
+HORIZON_STRATEGIES = ["linear", "exponential", "binary"]
+
+# compete: all threads search the whole search space with different strategies, split: the search space is divided among the threads
+PARALLEL_MODES = ["compete", "split"]
+
+def add_env(ctl, env, fact_loader="backend", precomputed_conn=None, cache=None):
+    """
+    add the facts of the environment to the control object
+    `backend` passes them as symbols through the clingo backend, `text` renders them to a string which is parsed by gringo
+    if a wait policy is given as `precomputed_conn`, the cell_conn/5 facts are computed in Python and added as well
+    rendered facts and cell_conn facts are taken from the FactCache `cache` if one is given
+    """
+    start_time = time.time()
+    conn = None
+    if precomputed_conn is not None:
+        conn = cached(cache, env, ("cell_conn", precomputed_conn), lambda: cell_conn_facts(env, precomputed_conn))
+    if fact_loader == "backend":
+        load_clingo_facts(ctl, env, skip_empty=True)
+        if conn is not None:
+            load_cell_conn(ctl, env, facts=conn)
+    elif fact_loader == "text":
+        ctl.add(cached(cache, env, "facts", lambda: convert_to_clingo(env, skip_empty=True)))
+        if conn is not None:
+            facts = io.StringIO()
+            write_cell_conn(env, facts, facts=conn)
+            ctl.add(facts.getvalue())
+    else:
+        raise ValueError(f"Unknown fact loader '{fact_loader}', expected one of {FACT_LOADERS}")
+    print(f"Environment facts added via {fact_loader} in {time.time() - start_time:.3f} seconds.")
+
+def add_segments(ctl, env, fact_loader="backend", cache=None):
+    """
+    contract the rail graph into segments and add the segment facts to the control object
+    returns the list of segments, needed to expand the plan back into per-cell actions
+    """
+    start_time = time.time()
+    segments = cached(cache, env, "segments", lambda: build_segments(env))
+    if fact_loader == "backend":
+        load_segments(ctl, segments)
+    else:
+        facts = io.StringIO()
+        write_segments(segments, facts)
+        ctl.add(facts.getvalue())
+    print(f"{len(segments)} segments added in {time.time() - start_time:.3f} seconds.")
+    return(segments)
+
+def add_reachability(ctl, env, deadline="horizon", fact_loader="backend", cache=None):
+    """
+    compute the time window of every state each train can pass on its way to the target and add the reach/5 facts to the control object
+    returns the number of facts added
+    """
+    start_time = time.time()
+    windows = cached(cache, env, ("reach", deadline), lambda: reach_windows(env, deadline))
+    if fact_loader == "backend":
+        load_reach(ctl, windows)
+    else:
+        facts = io.StringIO()
+        write_reach(windows, facts)
+        ctl.add(facts.getvalue())
+    print(f"{len(windows)} reachability windows added in {time.time() - start_time:.3f} seconds.")
+    return(len(windows))
+
+def register_occupancy(ctl, enabled=False):
+    """ register an OccupancyPropagator if enabled (for encodings without the grounded collision constraint), returns it or None """
+    if not enabled:
+        return(None)
+    propagator = OccupancyPropagator()
+    ctl.register_propagator(propagator)
+    return(propagator)
+
+def configure_threads(ctl, threads=None, parallel_mode="compete"):
+    """
+    let clasp solve with `threads` threads in the given parallel mode
+    nothing is changed if threads is None, so that -t/--parallel-mode on the command line still apply
+    """
+    if parallel_mode not in PARALLEL_MODES:
+        raise ValueError(f"Unknown parallel mode '{parallel_mode}', expected one of {PARALLEL_MODES}")
+    if threads is not None:
+        ctl.configuration.solve.parallel_mode = f"{threads},{parallel_mode}"
+        print(f"Solving with {threads} threads ({parallel_mode}).")
+
+# which models FlatlandPlan solves for
+# first:     stop at the first model
+# optimal:   the optimal model if the encoding has #minimize statements, otherwise the first one
+# enumerate: enumerate up to `max_models` models (0 for all) and keep the last one
+SOLVE_MODES = ["first", "optimal", "enumerate"]
+
+
+def extraction(extract="atoms"):
+    """
+    which symbols are taken from a model: "atoms" (all atoms), "shown" (only #show'n atoms and terms)
+    or a list of signatures such as ["action/3", "transition/7"], returned as a set of (name, arity) pairs
+    """
+    if extract in ("atoms", "shown"):
+        return(extract)
+    signatures = set()
+    for signature in extract:
+        name, _, arity = signature.rpartition("/")
+        if not name or not arity.isdigit():
+            raise ValueError(f"Invalid signature '{signature}', expected name/arity")
+        signatures.add((name, int(arity)))
+    return(signatures)
+
+
+def model_symbols(model, extract="atoms") -> list:
+    """ the symbols of a model selected by extraction() """
+    if extract == "atoms":
+        return(model.symbols(atoms=True))
+    if extract == "shown":
+        return(model.symbols(shown=True))
+    return([symbol for symbol in model.symbols(atoms=True) if (symbol.name, len(symbol.arguments)) in extract])
+
+
+def compact_statistics(statistics) -> dict:
+    """ atoms and rules of the ground program and conflicts and choices of the solver, the part of the clingo statistics a StepRecord keeps """
+    lp = statistics["problem"]["lp"]
+    solvers = statistics["solving"]["solvers"]
+    return({"atoms": int(lp["atoms"]), "rules": int(lp["rules"]), "conflicts": int(solvers["conflicts"]), "choices": int(solvers["choices"])})
+
+
+@dataclass
+class StepRecord:
+    """
+    compact statistics of one solve call of the incremental loop
+    times are in seconds, atoms and rules are those of the program passed to the solver in this step
+    """
+    step: int
+    ground_time: float
+    solve_time: float
+    atoms: int
+    rules: int
+    conflicts: int
+    choices: int
+    result: str
+
+    @classmethod
+    def from_statistics(cls, step, ground_time, solve_time, statistics, result):
+        return(cls(step, round(ground_time, 4), round(solve_time, 4), result=str(result), **compact_statistics(statistics)))
+
+
+def ground_base(ctl, plan, files):
+    """
+    add the environment and the options of the plan (segments, reachability, fixed actions) to the control object and ground the base program
+    if the plan has a GroundProgramCache, a saved ground base program is loaded instead, or saved after grounding
+    """
+    start_time = time.time()
+    key = None
+    if plan.ground_cache is not None:
+        key = plan.ground_cache.key(plan.env, files, plan.precomputed_conn, plan.segments, plan.reachability, plan.actions)
+        if plan.ground_cache.load(ctl, key):
+            if plan.segments:
+                plan.segment_table = cached(plan.cache, plan.env, "segments", lambda: build_segments(plan.env))
+            print(f"Ground base program loaded from {plan.ground_cache.path(key)} in {time.time() - start_time:.3f} seconds.")
+            return
+        recorder = plan.ground_cache.recorder(ctl)
+
+    with span("add env", fact_loader=plan.fact_loader):
+        add_env(ctl, plan.env, plan.fact_loader, plan.precomputed_conn, plan.cache)
+    if plan.segments:
+        with span("add segments"):
+            plan.segment_table = add_segments(ctl, plan.env, plan.fact_loader, plan.cache)
+    if plan.reachability is not None:
+        with span("add reachability", deadline=plan.reachability):
+            add_reachability(ctl, plan.env, plan.reachability, plan.fact_loader, plan.cache)
+
+    # add actions
+    if plan.actions is not None:
+        print(f".join(self.actions): {' '.join(plan.actions)}")
+        ctl.add('base', [], ' '.join(plan.actions))
+
+    # ground the program
+    with span("ground base"):
+        ctl.ground([("base", [])], context=plan)
+    print(f"Base program grounded in {time.time() - start_time:.3f} seconds.")
+    if key is not None:
+        plan.ground_cache.save(ctl, key, recorder)
+        print(f"Ground base program saved to {plan.ground_cache.path(key)}.")
+
 class IncrementalFlatlandPlan(Application):
     """ takes an environment and a set of primary encodings """
     program_name = "flatland_incremental"
     version = "1.0"
 
-    def __init__(self, env, actions=None, optimize=False):
+    def __init__(self, env, actions=None, optimize=False, fact_loader="backend", precomputed_conn=None, segments=False, reachability=None, cache=None, ground_cache=None, lower_bound=False,
+                 horizon="linear", horizon_step=8, threads=None, parallel_mode="compete", opt_budget=None, opt_patience=None, extract="atoms",
+                 step_log=None, full_stats=False, propagator=False):
         self.env = env
         self.actions = actions
+        self.fact_loader = fact_loader
+        self.precomputed_conn = precomputed_conn
+        self.segments = segments
+        self.reachability = reachability
+        # FactCache shared between plans, e.g. the initial plan and the replans of a simulation
+        self.cache = cache
+        # GroundProgramCache in which the ground base program is saved in aspif format
+        self.ground_cache = ground_cache
+        self.threads = threads
+        self.parallel_mode = parallel_mode
+        # check collisions with an OccupancyPropagator instead of the grounded constraint (use with asp/tk/encoding_incremental_propagator.lp)
+        self.propagator = propagator
+        # start the incremental loop at a lower bound on the makespan instead of at step 0
+        self.lower_bound = lower_bound
+        # how the incremental loop searches for the first satisfiable step, see HORIZON_STRATEGIES
+        if horizon not in HORIZON_STRATEGIES:
+            raise ValueError(f"Unknown horizon strategy '{horizon}', expected one of {HORIZON_STRATEGIES}")
+        self.horizon = horizon
+        self.horizon_step = horizon_step
+        self.max_time = None
+        # last grounded step, currently assumed query(t) external and (step, satisfiable) of every solve call
+        self.grounded = -1
+        self.query = None
+        self.probes = []
+        self.segment_table = None
         self.action_list = None
         self.model = None
         self.optimize = optimize
+        # stop the optimization after `opt_budget` seconds, or once the cost has not improved for `opt_patience` seconds
+        self.opt_budget = opt_budget
+        self.opt_patience = opt_patience
+        # symbols kept from the model, see extraction()
+        self.extract = extraction(extract)
         self.stats = {
             "total_running_time": None,
-            "incremental": None
+            "incremental": None,
+            # seconds spent in grounding (the base program and the incremental steps), in the solving calls of the incremental loop and in the optimization
+            "phases": {"ground": 0.0, "solve": 0.0, "optimize": 0.0}
         }
+        # a StepRecord of every solve call is kept in stats["steps"] and appended to the JSONL file `step_log` as soon as the step is solved,
+        # the full statistics tree of every step is only kept in incremental_stats if `full_stats` is set
+        self.step_log = step_log
+        self.full_stats = full_stats
+        self.stats["steps"] = []
         self.incremental_stats = []
         self.optimization_stats = []
 
@@ -46,18 +278,15 @@ class IncrementalFlatlandPlan(Application):
             ctl.load(f)
         if not files:
             raise Exception('No file loaded into clingo.')
+        if self.step_log is not None:
+            open(self.step_log, "w").close()
         
-        # add env
-        ctl.add(convert_to_clingo(self.env))
-        
-        # add actions
-        if self.actions is not None:
-            print(f".join(self.actions): {' '.join(self.actions)}")
-            ctl.add('base', [], ' '.join(self.actions))
-        
-
-        # ground the program
-        ctl.ground([("base", [])], context=self)
+        configure_threads(ctl, self.threads, self.parallel_mode)
+        self.occupancy = register_occupancy(ctl, self.propagator)
+        # add env and ground the base program (or load it from the ground program cache)
+        ground_start = time.time()
+        ground_base(ctl, self, files)
+        self.stats["phases"]["ground"] += time.time() - ground_start
         # ctl.configuration.solve.models="-1"
 
         max_time = ctl.symbolic_atoms.by_signature("global", 1)
@@ -71,89 +300,191 @@ class IncrementalFlatlandPlan(Application):
                 break
         if not max_time:
             raise Exception('No max_time defined in the encoding.')
+        self.max_time = max_time
 
-        models = []
         step = 0
+        if self.lower_bound:
+            # all trains arrived is unsatisfiable before the bound, so these steps are grounded in one call without solving
+            arrivals = cached(self.cache, self.env, "earliest_arrivals", lambda: earliest_arrivals(self.env))
+            bound = max([a for a in arrivals if a is not None], default=0)
+            step = min(bound, max_time - 1)
+            self.stats["lower_bound"] = bound
+            self.stats["skipped_steps"] = step
+            print(f"Makespan lower bound: {bound}, skipping {step} incremental steps.")
+        self.grounded = -1
+        self.query = None
+        self.probes = []
         result = None
-        while (result == None or result.unsatisfiable) and step < max_time:
-            print(f"Incremental step: {step}/{max_time}")
-            parts = []
-            parts.append(("check", [Number(step)]))
-            if step > 0:
-                query = Function("query", [Number(step - 1)])
-                ctl.release_external(query)
-                parts.append(("step", [Number(step)]))
-            ctl.ground(parts, context=self)
-            query = Function("query", [Number(step)])
-            ctl.assign_external(query, True)
-            symbolic_atoms = ctl.symbolic_atoms
-            print(f"number of symbolic atoms: {symbolic_atoms.__len__()}")
-            # for atom in symbolic_atoms.by_signature("action", 3):
-            #     print(atom.symbol)
-            # for atom in symbolic_atoms.by_signature("speed_action", 4):
-            #     print(atom.symbol)
-            # for atom in symbolic_atoms.by_signature("occupied", 3):
-            #     print(atom.symbol)
-            # for atom in symbolic_atoms.by_signature("state", 4):
-            #     print(atom.symbol)
-            # for atom in symbolic_atoms.by_signature("arrived", 2):
-            #     print(atom.symbol)
-            # for atom in symbolic_atoms:
-            #     if atom.symbol.name in ["transition", "possible_tansition", "arrived"]:
-            #         logger.info(f"Time step {step} -- Atom: {atom.literal} Symbol: {atom.symbol}")
-            handle = ctl.solve(yield_=True)
-            for model in handle:
-                models.append(model.symbols(atoms=True))
-
-            result = handle.get()
-            # model = handle.model()
-            current_running_time = time.time() - start_time
-            hours = int(current_running_time // 3600)
-            minutes = int((current_running_time % 3600) // 60)
-            seconds = current_running_time % 60
-            running_time_str = ""
-            if hours > 0:
-                running_time_str += f"{hours}h "
-            if minutes > 0 or hours > 0:
-                running_time_str += f"{minutes}m "
-            running_time_str += f"{seconds:.2f}s"
-            print(f"Current running time: {running_time_str}")
-            print(result)
-            self.incremental_stats.append(ctl.statistics)
+        if self.horizon == "linear":
+            while (result == None or result.unsatisfiable) and step < max_time:
+                result = self.solve_step(ctl, step, start_time)
+                step += 1
+        else:
+            # probe step, step + k, step + 3k, step + 7k, ... until a plan is found
+            last_unsat = step - 1
+            increment = self.horizon_step
+            while step < max_time:
+                result = self.solve_step(ctl, step, start_time)
+                if result.satisfiable:
+                    break
+                last_unsat = step
+                step = min(step + increment, max_time - 1) if step < max_time - 1 else max_time
+                increment *= 2
+            # narrow down the first satisfiable step, the current model always belongs to the smallest satisfiable step so far
+            if self.horizon == "binary" and result.satisfiable:
+                first_sat = step
+                while first_sat - last_unsat > 1:
+                    middle = (last_unsat + first_sat) // 2
+                    if self.solve_step(ctl, middle, start_time).satisfiable:
+                        first_sat = middle
+                    else:
+                        last_unsat = middle
+                step = first_sat
             step += 1
+        self.stats["horizon"] = {"strategy": self.horizon, "probes": self.probes}
 
         incremental_time = time.time() - start_time
-        self.stats["incremental"] = {"running_time": f"{incremental_time:.2f}", "stats": ctl.statistics}
-        if result.satisfiable and self.optimize:
+        # the full statistics tree is large, without full_stats only its compact summary is kept
+        self.stats["incremental"] = {"running_time": f"{incremental_time:.2f}", "stats": ctl.statistics if self.full_stats else compact_statistics(ctl.statistics)}
+        if self.model is not None and self.optimize:
             print(f"Solution found in {step} steps.")
-            ctl.release_external(Function("query", [Number(step-1)]))
+            ctl.release_external(self.query)
             ctl.configuration.solve.models="-1"
 
             parts = [("optimize", [])]
-            ctl.ground(parts, context=self)
-            handle = ctl.solve(yield_=True, on_model=self.log_optimization_model)
-            for model in handle:
-                models.append(model.symbols(atoms=True))
+            with span("ground optimize"):
+                ctl.ground(parts, context=self)
+            with span("optimize"):
+                best, stopped = self.optimize_anytime(ctl)
+            if best is not None:
+                self.model = best
             optimization_time = time.time() - incremental_time - start_time
-            print(f"Optimization running time: {optimization_time:.2f} seconds.")
-            self.stats["optimization"] = {"running_time": f"{optimization_time:.2f}", "stats": ctl.statistics}
+            self.stats["phases"]["optimize"] = optimization_time
+            print(f"Optimization running time: {optimization_time:.2f} seconds ({stopped}).")
+            self.stats["optimization"] = {"running_time": f"{optimization_time:.2f}", "stopped": stopped,
+                                          "improvements": self.optimization_stats, "stats": ctl.statistics if self.full_stats else compact_statistics(ctl.statistics)}
         
-        if models:
-            self.model = models[-1]
+        if self.model is not None:
             print(f"Final model has {len(self.model)} symbols.")
-            self.action_list = build_action_list(models)
+            self.action_list = build_action_matrix(self.model, len(self.env.agents), self.segment_table)
             print(f"Action list built with {len(self.action_list)} steps.")
             # capture output actions for renderer
-            #return(build_action_list(models))
+            #return(build_action_matrix(self.model, len(self.env.agents)))
         else:
             print("No models were found.")
-            self.model = None
             self.action_list = None
         current_time = time.time()
         total_running_time = current_time - start_time
         print(f"Total running time: {total_running_time:.2f} seconds.")
         self.stats["total_running_time"] = f"{total_running_time:.2f}"
 
+    def solve_step(self, ctl, step, start_time):
+        """
+        ground the check and step programs up to `step` (if not done yet), assume that all trains have arrived by `step` and solve
+        a model found replaces self.model, returns the solve result
+        """
+        print(f"Incremental step: {step}/{self.max_time}")
+        parts = []
+        for t in range(self.grounded + 1, step + 1):
+            parts.append(("check", [Number(t)]))
+            if t > 0:
+                parts.append(("step", [Number(t)]))
+        ground_time = 0.0
+        if parts:
+            ground_start = time.time()
+            with span("ground step", step=step):
+                ctl.ground(parts, context=self)
+            ground_time = time.time() - ground_start
+            self.stats["phases"]["ground"] += ground_time
+            self.grounded = step
+        if self.query is not None:
+            ctl.release_external(self.query)
+        self.query = Function("query", [Number(step)])
+        ctl.assign_external(self.query, True)
+        symbolic_atoms = ctl.symbolic_atoms
+        print(f"number of symbolic atoms: {symbolic_atoms.__len__()}")
+        # for atom in symbolic_atoms.by_signature("action", 3):
+        #     print(atom.symbol)
+        # for atom in symbolic_atoms.by_signature("arrived", 2):
+        #     print(atom.symbol)
+        solve_time = time.time()
+        with span("solve step", step=step):
+            handle = ctl.solve(yield_=True)
+            for model in handle:
+                self.model = model_symbols(model, self.extract)
+            result = handle.get()
+        solve_time = time.time() - solve_time
+        self.stats["phases"]["solve"] += solve_time
+        current_running_time = time.time() - start_time
+        hours = int(current_running_time // 3600)
+        minutes = int((current_running_time % 3600) // 60)
+        seconds = current_running_time % 60
+        running_time_str = ""
+        if hours > 0:
+            running_time_str += f"{hours}h "
+        if minutes > 0 or hours > 0:
+            running_time_str += f"{minutes}m "
+        running_time_str += f"{seconds:.2f}s"
+        print(f"Current running time: {running_time_str}")
+        print(result)
+        self.log_step(StepRecord.from_statistics(step, ground_time, solve_time, ctl.statistics, result))
+        if self.full_stats:
+            self.incremental_stats.append(ctl.statistics)
+        self.probes.append((step, result.satisfiable))
+        return(result)
+
+    def log_step(self, record):
+        """ keep the StepRecord of a solve call and append it to the step log """
+        self.stats["steps"].append(asdict(record))
+        if self.step_log is not None:
+            with open(self.step_log, "a") as f:
+                f.write(json.dumps(asdict(record)) + "\n")
+
+    def optimize_anytime(self, ctl):
+        """
+        solve the optimize program asynchronously until optimality is proven, the budget runs out or the cost stalls
+        returns the best model found (or None) and why the optimization stopped: "optimal", "budget", "patience" or "exhausted"
+        the time and cost of every improvement are appended to self.optimization_stats
+        """
+        best = None
+        start_time = time.time()
+        last_improvement = start_time
+
+        def on_model(model):
+            nonlocal best, last_improvement
+            # the solver only reports models that are better than the previous one
+            best = model_symbols(model, self.extract)
+            last_improvement = time.time()
+            self.optimization_stats.append({"time": round(last_improvement - start_time, 3), "cost": list(model.cost)})
+            self.log_optimization_model(model)
+
+        def next_deadline():
+            # the earliest of the budget and patience deadlines, (None, None) if neither is set
+            deadlines = []
+            if self.opt_budget is not None:
+                deadlines.append((start_time + self.opt_budget, "budget"))
+            if self.opt_patience is not None:
+                deadlines.append((last_improvement + self.opt_patience, "patience"))
+            return(min(deadlines, default=(None, None)))
+
+        stopped = None
+        with ctl.solve(async_=True, on_model=on_model) as handle:
+            while True:
+                deadline, _ = next_deadline()
+                timeout = None if deadline is None else max(deadline - time.time(), 0)
+                if handle.wait(timeout):
+                    break
+                # the wait does not return early on a new model, so an improvement during it may have moved the patience deadline
+                deadline, reason = next_deadline()
+                if deadline is not None and time.time() >= deadline:
+                    stopped = reason
+                    handle.cancel()
+                    break
+            result = handle.get()
+        if stopped is None:
+            stopped = "optimal" if result.satisfiable and result.exhausted else "exhausted"
+        return(best, stopped)
+
     def log_optimization_model(self, model):
         # print human-readable timestamp
         print(f"Optimization model found at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}")
@@ -168,12 +499,34 @@ class FlatlandPlan(Application):
     program_name = "flatland"
     version = "1.0"
 
-    def __init__(self, env, actions=None):
+    def __init__(self, env, actions=None, fact_loader="backend", precomputed_conn=None, segments=False, reachability=None, cache=None, ground_cache=None,
+                 threads=None, parallel_mode="compete", solve_mode="optimal", max_models=0, extract="atoms", propagator=False):
         self.env = env
         self.actions = actions
+        self.fact_loader = fact_loader
+        self.precomputed_conn = precomputed_conn
+        self.segments = segments
+        self.reachability = reachability
+        # FactCache shared between plans, e.g. the initial plan and the replans of a simulation
+        self.cache = cache
+        # GroundProgramCache in which the ground base program is saved in aspif format
+        self.ground_cache = ground_cache
+        self.threads = threads
+        self.parallel_mode = parallel_mode
+        # check collisions with an OccupancyPropagator instead of the grounded constraint (use with asp/tk/encoding_incremental_propagator.lp)
+        self.propagator = propagator
+        # which models are solved for, see SOLVE_MODES, and which of their symbols are kept, see extraction()
+        if solve_mode not in SOLVE_MODES:
+            raise ValueError(f"Unknown solve mode '{solve_mode}', expected one of {SOLVE_MODES}")
+        self.solve_mode = solve_mode
+        self.max_models = max_models
+        self.extract = extraction(extract)
+        self.segment_table = None
         self.action_list = None
         self.model = None
         self.stats = None
+        # seconds spent grounding and solving
+        self.phases = {"ground": 0.0, "solve": 0.0}
         print(f"Initialized FlatlandPlan with env: {env} and actions: {actions}")
 
     def main(self, ctl, files):
@@ -183,35 +536,180 @@ class FlatlandPlan(Application):
         if not files:
             raise Exception('No file loaded into clingo.')
         print(f"Loaded files: {files}")
-        # add env
-        ctl.add(convert_to_clingo(self.env))
-        
-        # add actions
-        if self.actions is not None:
-            print(f".join(self.actions): {' '.join(self.actions)}")
-            ctl.add('base', [], ' '.join(self.actions))
-        
-        # ground the program
-        ctl.ground([("base", [])], context=self)
-        ctl.configuration.solve.models="-1"
+        configure_threads(ctl, self.threads, self.parallel_mode)
+        self.occupancy = register_occupancy(ctl, self.propagator)
+        # add env and ground the base program (or load it from the ground program cache)
+        ground_time = time.time()
+        with span("ground"):
+            ground_base(ctl, self, files)
+        self.phases["ground"] = time.time() - ground_time
+        ctl.configuration.solve.models = {"first": 1, "optimal": 0, "enumerate": self.max_models}[self.solve_mode]
 
-        # solve and save models
-        models = []
-        with ctl.solve(yield_=True) as handle:
+        # solve and keep the last model, which is the best one found when optimizing
+        solve_time = time.time()
+        with span("solve", mode=self.solve_mode), ctl.solve(yield_=True) as handle:
             for model in handle:
-                models.append(model.symbols(atoms=True))
-        
-        self.model = models[-1] if models else None
+                self.model = model_symbols(model, self.extract)
+                # without #minimize statements every model is optimal
+                if self.solve_mode == "optimal" and not model.cost:
+                    break
+        self.phases["solve"] = time.time() - solve_time
+
         # capture output actions for renderer
-        #return(build_action_list(models))
-        self.action_list = build_action_list(models)
+        #return(build_action_matrix(self.model, len(self.env.agents)))
+        self.action_list = build_action_matrix(self.model, len(self.env.agents), self.segment_table) if self.model is not None else None
 
         self.stats = ctl.statistics
 
 
-# let's see later whether we even need this
-class FlatlandReplan(Application):
-    """ takes an environment, a set of secondary encodings, and additional context """
-    program_name = "flatland"
-    version = "1.0"
+# how FlatlandReplan steers the solver towards the previous plan
+# sign:  the actions of the previous plan are tried as true first
+# level: additionally, they are decided on before all other atoms
+WARM_STARTS = ["sign", "level"]
+
+# options of FlatlandPlan / IncrementalFlatlandPlan that FlatlandReplan understands as well
+REPLAN_OPTIONS = ["fact_loader", "precomputed_conn", "segments", "reachability", "cache", "ground_cache", "threads", "parallel_mode", "extract", "propagator"]
+
+class FlatlandReplan():
+    """
+    keeps one clingo control object alive over all replans of a simulation
+    the environment is grounded once, executed actions and malfunction waits are passed to each solve call as assumptions
+    with incremental encodings, further steps are grounded whenever the current horizon is too short
+    with a warm start, the actions of the previous plan are passed as domain heuristics, so that the repaired plan is searched near it
+    """
+    def __init__(self, env, files, incremental=False, fact_loader="backend", precomputed_conn=None, segments=False, reachability=None, cache=None, ground_cache=None,
+                 threads=None, parallel_mode="compete", extract="atoms", propagator=False, warm_start=None, actions=None):
+        if warm_start is not None and warm_start not in WARM_STARTS:
+            raise ValueError(f"Unknown warm start '{warm_start}', expected one of {WARM_STARTS}")
+        self.env = env
+        self.files = files
+        self.incremental = incremental
+        # additional facts or rules added to the base program, as for FlatlandPlan
+        self.actions = actions
+        self.fact_loader = fact_loader
+        self.precomputed_conn = precomputed_conn
+        self.segments = segments
+        self.reachability = reachability
+        self.cache = cache
+        self.ground_cache = ground_cache
+        self.threads = threads
+        self.parallel_mode = parallel_mode
+        # check collisions with an OccupancyPropagator instead of the grounded constraint (use with asp/tk/encoding_incremental_propagator.lp)
+        self.propagator = propagator
+        self.extract = extraction(extract)
+        self.warm_start = warm_start
+        # external atom that enables the heuristics of the current replan, and the number of them added so far
+        self.hint_guard = None
+        self.hint_count = 0
+        self.segment_table = None
+        self.ctl = None
+        self.step = None
+        self.max_time = env._max_episode_steps
+        self.model = None
+        self.stats = []
+
+    def setup(self) -> None:
+        """ load the encodings and ground the base program (and check(0) for incremental encodings) """
+        # #heuristic statements are ignored by the default solver heuristic
+        self.ctl = clingo.Control(["--warn=none"] + (["--heuristic=Domain"] if self.warm_start else []))
+        configure_threads(self.ctl, self.threads, self.parallel_mode)
+        self.occupancy = register_occupancy(self.ctl, self.propagator)
+        for f in self.files:
+            self.ctl.load(f)
+        ground_base(self.ctl, self, self.files)
+        if self.incremental:
+            self.ctl.ground([("check", [Number(0)])], context=self)
+            self.ctl.assign_external(Function("query", [Number(0)]), True)
+            self.step = 0
+
+    def extend(self, horizon) -> None:
+        """ ground check(t) and step(t) up to timestep `horizon` in one call """
+        horizon = min(horizon, self.max_time)
+        if horizon <= self.step:
+            return
+        parts = []
+        for t in range(self.step + 1, horizon + 1):
+            parts.append(("check", [Number(t)]))
+            parts.append(("step", [Number(t)]))
+        start_time = time.time()
+        with span("ground steps", first=self.step + 1, last=horizon):
+            self.ctl.ground(parts, context=self)
+        print(f"Grounded steps {self.step + 1} to {horizon} in {time.time() - start_time:.3f} seconds.")
+        # externals are false unless assigned, so assuming query(t) instead would not work
+        self.ctl.release_external(Function("query", [Number(self.step)]))
+        self.ctl.assign_external(Function("query", [Number(horizon)]), True)
+        self.step = horizon
+
+    def missing(self, assumptions) -> list:
+        """
+        symbols that have to be true but have not been grounded (yet), clingo would silently ignore them as assumptions
+        """
+        return([symbol for symbol, truth in assumptions if truth and self.ctl.symbolic_atoms[symbol] is None])
+
+    def add_hints(self, hints) -> int:
+        """
+        prefer the given action symbols in the next solve calls, the heuristics of earlier calls are dropped
+        the #heuristic statements are conditioned on a new external atom, releasing it switches them off for good
+        returns the number of hinted actions, symbols that have not been grounded (yet) are skipped
+        """
+        if self.hint_guard is not None:
+            self.ctl.release_external(self.hint_guard)
+            self.hint_guard = None
+        symbols = [symbol for symbol in hints if self.ctl.symbolic_atoms[symbol] is not None]
+        if not symbols:
+            return(0)
+        with self.ctl.backend() as backend:
+            guard = backend.add_atom(Function("warm_start", [Number(self.hint_count)]))
+            backend.add_external(guard, TruthValue.True_)
+            for symbol in symbols:
+                atom = backend.add_atom(symbol)
+                backend.add_heuristic(atom, HeuristicType.Sign, 1, 1, [guard])
+                if self.warm_start == "level":
+                    backend.add_heuristic(atom, HeuristicType.Level, 1, 1, [guard])
+        self.hint_guard = guard
+        self.hint_count += 1
+        return(len(symbols))
+
+    def replan(self, assumptions, horizon=0, hints=None) -> list:
+        """
+        find a plan that agrees with the assumptions, returns the action list or None if there is none
+        for incremental encodings, solving starts at timestep `horizon` (e.g. the length of the previous plan) and moves on one step at a time
+        with a warm start, the actions of `hints` (usually the previous plan) are preferred, without a warm start they are ignored
+        """
+        start_time = time.time()
+        if self.ctl is None:
+            with span("replan setup"):
+                self.setup()
+        hints = [symbol for symbol, _ in convert_formers_to_assumptions(hints)] if self.warm_start and hints is not None else []
+
+        models = []
+        solve_time = 0.0
+        hinted = 0
+        while True:
+            if self.incremental:
+                self.extend(max(horizon, self.step))
+            missing = self.missing(assumptions)
+            if not missing:
+                # added before every solve call, since extending the horizon grounds further hinted actions
+                if hints:
+                    hinted = self.add_hints(hints)
+                solve_start = time.time()
+                with span("replan solve", step=self.step), self.ctl.solve(assumptions=assumptions, yield_=True) as handle:
+                    for model in handle:
+                        models.append(model_symbols(model, self.extract))
+                        break
+                solve_time += time.time() - solve_start
+            if models or not self.incremental or self.step >= self.max_time:
+                break
+            # an assumed action within the grounded steps that does not exist cannot be fixed by a longer horizon
+            if missing and all(symbol.arguments[-1].number <= self.step for symbol in missing):
+                break
+            horizon = self.step + 1
 
+        self.stats.append({"running_time": f"{time.time() - start_time:.2f}", "solve_time": f"{solve_time:.3f}", "step": self.step, "satisfiable": bool(models),
+                           "warm_start": self.warm_start, "hinted": hinted})
+        print(f"Replan {'found' if models else 'did not find'} a plan in {time.time() - start_time:.2f} seconds.")
+        if not models:
+            return(None)
+        self.model = models[-1]
+        return(build_action_matrix(self.model, len(self.env.agents), self.segment_table))
@@ -0,0 +1,220 @@
+"""
+content-addressed cache for the facts and tables derived from an environment
+"""
+
+import os
+import glob
+import pickle
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import clingo
+from modules.convert import agent_facts
+
+# bump when the layout of a cached table changes, so that stale files on disk are not picked up
+CACHE_VERSION = 1
+
+
+def env_key(env) -> str:
+    """
+    hash of everything the derived tables depend on: the rail grid, the agents and the episode length
+    two environments with the same key produce the same facts, even if they were loaded from different files
+    """
+    grid = np.ascontiguousarray(env.rail.grid, dtype=np.uint16)
+    h = hashlib.sha256()
+    h.update(f"v{CACHE_VERSION};{grid.shape};{env._max_episode_steps};".encode())
+    h.update(grid.tobytes())
+    h.update(repr(agent_facts(env)).encode())
+    return(h.hexdigest())
+
+
+class FactCache():
+    """
+    keeps the derived tables of recently used environments, e.g. the environment facts as text,
+    cell_conn facts, segments and reachability windows
+    tables are grouped per environment key; the least recently used environments are evicted once
+    more than `max_entries` are held in memory or, if a `directory` is given, once the files there exceed `max_bytes`
+    """
+    def __init__(self, directory=None, max_entries=32, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, env, table, compute):
+        """ look up a table of the environment, computing and storing it on a miss """
+        key = env_key(env)
+        tables = self.load(key)
+        if table in tables:
+            self.hits += 1
+            return(tables[table])
+        self.misses += 1
+        tables[table] = compute()
+        self.store(key, tables)
+        return(tables[table])
+
+    def path(self, key) -> str:
+        return(os.path.join(self.directory, f"{key}.pkl"))
+
+    def load(self, key) -> dict:
+        """ tables of the environment with the given key, from memory or from disk """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return(self.entries[key])
+        tables = {}
+        if self.directory is not None and os.path.exists(self.path(key)):
+            try:
+                with open(self.path(key), "rb") as f:
+                    tables = pickle.load(f)
+                # the modification time marks the last use for eviction
+                os.utime(self.path(key))
+            except (OSError, EOFError, pickle.UnpicklingError):
+                tables = {}
+        self.remember(key, tables)
+        return(tables)
+
+    def store(self, key, tables) -> None:
+        """ keep the tables in memory and, if a directory is given, write them to disk """
+        self.remember(key, tables)
+        if self.directory is None:
+            return
+        tmp = self.path(key) + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path(key))
+        evict_files(self.directory, "*.pkl", self.max_bytes)
+
+    def remember(self, key, tables) -> None:
+        self.entries[key] = tables
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """ drop all tables, in memory and on disk """
+        self.entries.clear()
+        if self.directory is not None:
+            for p in glob.glob(os.path.join(self.directory, "*.pkl")):
+                os.remove(p)
+
+
+def evict_files(directory, pattern, max_bytes) -> None:
+    """ delete the least recently used files matching the pattern until the directory fits into max_bytes """
+    files = [(os.path.getmtime(p), os.path.getsize(p), p) for p in glob.glob(os.path.join(directory, pattern))]
+    total = sum(size for _, size, _ in files)
+    for _, size, p in sorted(files):
+        if total <= max_bytes:
+            break
+        os.remove(p)
+        total -= size
+
+
+def cached(cache, env, table, compute):
+    """ look up a table in the cache if there is one, otherwise just compute it """
+    if cache is None:
+        return(compute())
+    return(cache.get(env, table, compute))
+
+
+def aspif(*tokens) -> str:
+    return(" ".join(str(t) for t in tokens))
+
+
+class GroundProgramRecorder(clingo.Observer):
+    """
+    records the ground program passed to the solver as aspif statements while `active` is set
+    symbols are not taken from the observer but from the symbolic atoms once grounding is done, see GroundProgramCache.save
+    """
+    def __init__(self):
+        self.active = True
+        self.lines = []
+
+    def rule(self, choice, head, body):
+        if self.active:
+            self.lines.append(aspif(1, int(choice), len(head), *head, 0, len(body), *body))
+
+    def weight_rule(self, choice, head, lower_bound, body):
+        if self.active:
+            self.lines.append(aspif(1, int(choice), len(head), *head, 1, lower_bound, len(body), *[x for lw in body for x in lw]))
+
+    def minimize(self, priority, literals):
+        if self.active:
+            self.lines.append(aspif(2, priority, len(literals), *[x for lw in literals for x in lw]))
+
+    def project(self, atoms):
+        if self.active:
+            self.lines.append(aspif(3, len(atoms), *atoms))
+
+    def output_term(self, symbol, condition):
+        if self.active:
+            self.lines.append(aspif(4, len(str(symbol)), symbol, len(condition), *condition))
+
+    def external(self, atom, value):
+        if self.active:
+            self.lines.append(aspif(5, atom, value.value))
+
+    def assume(self, literals):
+        if self.active:
+            self.lines.append(aspif(6, len(literals), *literals))
+
+    def heuristic(self, atom, type_, bias, priority, condition):
+        if self.active:
+            self.lines.append(aspif(7, type_.value, atom, bias, priority, len(condition), *condition))
+
+    def acyc_edge(self, node_u, node_v, condition):
+        if self.active:
+            self.lines.append(aspif(8, node_u, node_v, len(condition), *condition))
+
+
+class GroundProgramCache():
+    """
+    saves the ground base program of an environment and a set of encodings in aspif format, so that later runs can load it instead of grounding again
+    files are keyed by the environment, the contents of the encodings and any further options that change the base program
+    loading the aspif file adds all atoms to the domain of the grounder, so that further subprograms (e.g. step(t)) can be grounded on top of it
+    """
+    def __init__(self, directory="cache/ground", max_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, env, files, *options) -> str:
+        h = hashlib.sha256()
+        h.update(f"{env_key(env)};{clingo.__version__};{options}".encode())
+        for f in files:
+            with open(f, "rb") as src:
+                h.update(src.read())
+        return(h.hexdigest())
+
+    def path(self, key) -> str:
+        return(os.path.join(self.directory, f"{key}.aspif"))
+
+    def load(self, ctl, key) -> bool:
+        """ load the ground base program into the control object, returns False if it has not been saved yet """
+        if not os.path.exists(self.path(key)):
+            return(False)
+        os.utime(self.path(key))
+        ctl.load(self.path(key))
+        return(True)
+
+    def recorder(self, ctl) -> GroundProgramRecorder:
+        """ start recording the ground program of the control object, must be called before grounding """
+        recorder = GroundProgramRecorder()
+        ctl.register_observer(recorder)
+        return(recorder)
+
+    def save(self, ctl, key, recorder) -> None:
+        """ stop recording and write the ground program, with every symbolic atom as an output statement """
+        recorder.active = False
+        outputs = [aspif(4, len(str(a.symbol)), a.symbol, 0) if a.is_fact else aspif(4, len(str(a.symbol)), a.symbol, 1, a.literal)
+                   for a in ctl.symbolic_atoms]
+        tmp = self.path(key) + ".tmp"
+        with open(tmp, "w") as f:
+            f.write("asp 1 0 0\n")
+            f.write("\n".join(recorder.lines + outputs))
+            f.write("\n0\n")
+        os.replace(tmp, self.path(key))
+        evict_files(self.directory, "*.aspif", self.max_bytes)
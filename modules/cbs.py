@@ -0,0 +1,92 @@
+"""
+conflict-based search: plan every train on its own and resolve the conflicts between their plans one at a time
+"""
+
+import heapq
+import itertools
+import time
+from clingo.application import clingo_main
+from modules.api import FlatlandPlan, IncrementalFlatlandPlan
+from modules.actionlist import ActionMatrix
+from modules.convert import convert_formers_to_assumptions
+from modules.prioritized import RESERVATIONS, sub_env, occupancy, check_occupancy, first_conflict, merge_plans
+
+
+class ConflictBasedPlan():
+    """
+    plans each train with FlatlandPlan or IncrementalFlatlandPlan on an environment that only contains this train,
+    so the collision constraints between pairs of trains are never grounded
+    the high level search expands the node with the lowest sum of arrival times: at its first conflict, one child
+    forbids the cell at that timestep for the first train and the other one for the second train; only the constrained train is replanned
+    gives up after expanding `max_nodes` nodes
+    """
+    def __init__(self, env, files, incremental=True, max_nodes=200, plan_options=None):
+        self.env = env
+        self.files = list(files) + [RESERVATIONS]
+        self.incremental = incremental
+        self.max_nodes = max_nodes
+        # keyword arguments of FlatlandPlan / IncrementalFlatlandPlan, the models have to contain the occupies/3 (or occupied/3) and arrived/2 atoms
+        self.plan_options = dict(plan_options if plan_options is not None else {}, extract="atoms")
+        self.action_list = None
+        self.model = None
+        # plans of a train under a set of constraints, so that no train is planned twice with the same constraints
+        self.plans = {}
+        self.stats = {"nodes": 0, "low_level": 0, "conflicts": []}
+
+    def plan_train(self, train, constraints):
+        """ (cost, occupancy, actions) of the train avoiding the forbidden (cell, timestep) pairs, None if there is no plan """
+        key = (train, constraints)
+        if key not in self.plans:
+            facts = [f"reserved({c},{t})." for c, t in sorted(constraints)]
+            env = sub_env(self.env, [train])
+            if self.incremental:
+                app = IncrementalFlatlandPlan(env, facts, **self.plan_options)
+            else:
+                app = FlatlandPlan(env, facts, **self.plan_options)
+            clingo_main(app, self.files + ["--outf=3"])
+            self.stats["low_level"] += 1
+            if app.action_list is None:
+                self.plans[key] = None
+            else:
+                arrivals = [s.arguments[1].number for s in app.model if s.name == "arrived" and len(s.arguments) == 2]
+                occupied = occupancy(app.model, [train])
+                check_occupancy(occupied, [train])
+                self.plans[key] = (min(arrivals, default=len(app.action_list)), occupied[train], app.action_list)
+        return(self.plans[key])
+
+    def plan(self) -> ActionMatrix:
+        """ plan all trains, returns the joint action matrix or None if no conflict free plan was found """
+        start_time = time.time()
+        trains = list(range(len(self.env.agents)))
+        constraints = {train: frozenset() for train in trains}
+        plans = {train: self.plan_train(train, constraints[train]) for train in trains}
+        if any(p is None for p in plans.values()):
+            print(f"No plan for trains {[t for t, p in plans.items() if p is None]} even without conflicts.")
+            return(None)
+        # without occupancy atoms every node would look conflict free, plan_train checks the plans found during the search
+        check_occupancy({train: p[1] for train, p in plans.items()}, trains)
+
+        # nodes are (cost, tie breaker, constraints, plans), the counter keeps heapq from comparing dicts
+        counter = itertools.count()
+        open_nodes = [(sum(p[0] for p in plans.values()), next(counter), constraints, plans)]
+        while open_nodes and self.stats["nodes"] < self.max_nodes:
+            cost, _, constraints, plans = heapq.heappop(open_nodes)
+            self.stats["nodes"] += 1
+            conflict = first_conflict({train: p[1] for train, p in plans.items()})
+            if conflict is None:
+                self.action_list = merge_plans([([train], p[2]) for train, p in plans.items()], len(trains))
+                # the models number their train 0, so only the action/3 atoms are kept, with the original train numbers
+                self.model = [symbol for symbol, _ in convert_formers_to_assumptions(self.action_list)]
+                break
+            t, cell, first, second = conflict
+            self.stats["conflicts"].append({"timestep": t, "cell": cell, "trains": [first, second]})
+            for train in (first, second):
+                child = {**constraints, train: constraints[train] | {(cell, t)}}
+                replanned = self.plan_train(train, child[train])
+                if replanned is None:
+                    continue
+                child_plans = {**plans, train: replanned}
+                heapq.heappush(open_nodes, (cost - plans[train][0] + replanned[0], next(counter), child, child_plans))
+        self.stats["running_time"] = f"{time.time() - start_time:.2f}"
+        print(f"Conflict-based search expanded {self.stats['nodes']} nodes with {self.stats['low_level']} single train plans in {self.stats['running_time']} seconds.")
+        return(self.action_list)
@@ -1,62 +1,111 @@
+import io
+import os
+import numpy as np
+from clingo.symbol import Function, Number, Tuple_
 from flatland.envs.rail_env import RailEnv
 from flatland.envs.rail_env import RailEnvActions
 from flatland.utils.rendertools import RenderTool, AgentRenderVariant
+from modules.actionlist import ACTION_NAMES
 
 
-def convert_to_clingo(env) -> str:
+def agent_facts(env) -> list:
     """
-    converts Flatland environment to clingo facts
+    collect the start, end and speed information of each agent as tuples
+    (agent_num, (init_y, init_x), min_start, direction, (goal_y, goal_x), max_end, speed)
     """
-    # environment properties
-    rail_map = env.rail.grid
-    height, width, agents = env.height, env.width, env.agents
-    clingo_str = f"% clingo representation of a Flatland environment\n% height: {height}, width: {width}, agents: {len(agents)}\n"
-    clingo_str += f"\nglobal({env._max_episode_steps}).\n"
-
-    # save start and end positions for each agent
     dir_map = {0:"n", 1:"e", 2:"s", 3:"w"}
-    
+    agents = []
     for agent_num, agent_info in enumerate(env.agents):
-        init_y, init_x = agent_info.initial_position
-        goal_y, goal_x = agent_info.target
-        min_start, max_end = agent_info.earliest_departure, agent_info.latest_arrival
         try:
             speed = int(1/agent_info.speed_counter.speed) # inverse, e.g. 1/2 --> 2, 1/4 --> 4 etc.
         except ZeroDivisionError:
             speed = 0
+        agents.append((agent_num, tuple(agent_info.initial_position), agent_info.earliest_departure, dir_map[agent_info.initial_direction],
+                       tuple(agent_info.target), agent_info.latest_arrival, speed))
+    return(agents)
 
-        direction = dir_map[agent_info.initial_direction]
-        clingo_str += f"\ntrain({agent_num}). "
-        clingo_str += f"start({agent_num},({init_y},{init_x}),{min_start},{direction}). "
-        clingo_str += f"end({agent_num},({goal_y},{goal_x}),{max_end}). "
-        clingo_str += f"speed({agent_num},{speed}).\n"
-
-    clingo_str += "\n"
-
-    # create an atom for each cell in the environment
-    #row_num = len(rail_map) - 1
-    for row, row_array in enumerate(rail_map):
-        for col, cval in enumerate(row_array):
-            clingo_str += f"cell(({row},{col}), {cval}).\n"
-        #row_num -= 1
-        clingo_str+="\n"
-        
-    return(clingo_str)
-
-def convert_formers_to_clingo(actions) -> str:
-    # change back to the clingo names
-    mapping = {RailEnvActions.MOVE_FORWARD:"move_forward", RailEnvActions.MOVE_RIGHT:"move_right", RailEnvActions.MOVE_LEFT:"move_left", RailEnvActions.STOP_MOVING:"wait"}
-    for index, dict in enumerate(actions):
-        for key in dict.keys():
-            actions[index][key] = mapping[actions[index][key]]
 
-    facts = []
-    # change from dictionary into facts
-    for index, dict in enumerate(actions):
-        for key in dict.keys():
-            facts.append(f':- not action(train({key}),{actions[index][key]},{index}).\n') #remove: can this be a list of strings or should it be one long string?
-    
-    return(facts)
+def cell_facts(env, skip_empty=True) -> tuple:
+    """
+    find the cells of the rail grid with numpy, returns the arrays (rows, cols, values)
+    cells without any track (value 0) are dropped if skip_empty is set
+    """
+    rail_map = np.asarray(env.rail.grid)
+    if skip_empty:
+        rows, cols = np.nonzero(rail_map)
+    else:
+        rows, cols = np.indices(rail_map.shape).reshape(2, -1)
+    return(rows, cols, rail_map[rows, cols])
+
+
+def write_clingo(env, out, skip_empty=True) -> None:
+    """
+    writes the clingo facts of a Flatland environment to a file path or an open stream
+    the cell facts are rendered in one bulk join instead of growing a string cell by cell
+    """
+    if isinstance(out, (str, os.PathLike)):
+        with open(out, "w") as f:
+            write_clingo(env, f, skip_empty=skip_empty)
+        return
+
+    height, width, agents = env.height, env.width, env.agents
+    out.write(f"% clingo representation of a Flatland environment\n% height: {height}, width: {width}, agents: {len(agents)}\n")
+    out.write(f"\nglobal({env._max_episode_steps}).\n\n")
+
+    # save start and end positions for each agent
+    out.write("".join(
+        f"train({agent_num}). start({agent_num},({init_y},{init_x}),{min_start},{direction}). end({agent_num},({goal_y},{goal_x}),{max_end}). speed({agent_num},{speed}).\n"
+        for agent_num, (init_y, init_x), min_start, direction, (goal_y, goal_x), max_end, speed in agent_facts(env)))
+    out.write("\n")
+
+    # create an atom for each (non-empty) cell in the environment
+    rows, cols, values = cell_facts(env, skip_empty=skip_empty)
+    out.write("".join(f"cell(({row},{col}), {cval}).\n" for row, col, cval in zip(rows.tolist(), cols.tolist(), values.tolist())))
+
+
+def convert_to_clingo(env, skip_empty=False) -> str:
+    """
+    converts Flatland environment to clingo facts
+    """
+    out = io.StringIO()
+    write_clingo(env, out, skip_empty=skip_empty)
+    return(out.getvalue())
+
+def load_clingo_facts(ctl, env, skip_empty=True) -> int:
+    """
+    adds the facts of a Flatland environment directly as symbols through the clingo backend,
+    so that they do not have to be rendered to text and parsed by gringo again
+    returns the number of facts added
+    """
+    # creating symbols dominates the loading time, so numbers are only created once
+    numbers = {}
+    def num(n):
+        if n not in numbers:
+            numbers[n] = Number(n)
+        return(numbers[n])
+
+    facts = [Function("global", [num(env._max_episode_steps)])]
+    for agent_num, (init_y, init_x), min_start, direction, (goal_y, goal_x), max_end, speed in agent_facts(env):
+        train = num(agent_num)
+        facts.append(Function("train", [train]))
+        facts.append(Function("start", [train, Tuple_([num(init_y), num(init_x)]), num(min_start), Function(direction)]))
+        facts.append(Function("end", [train, Tuple_([num(goal_y), num(goal_x)]), num(max_end)]))
+        facts.append(Function("speed", [train, num(speed)]))
+
+    rows, cols, values = cell_facts(env, skip_empty=skip_empty)
+    for row, col, cval in zip(rows.tolist(), cols.tolist(), values.tolist()):
+        facts.append(Function("cell", [Tuple_([num(row), num(col)]), num(cval)]))
+
+    with ctl.backend() as backend:
+        for fact in facts:
+            backend.add_rule([backend.add_atom(fact)])
+    return(len(facts))
+
+
+def convert_formers_to_clingo(actions) -> list:
+    """ executed actions of an action matrix as constraints """
+    timesteps, agents, codes = actions.entries()
+    return([f':- not action(train({agent}),{ACTION_NAMES[code]},{timestep}).\n' for timestep, agent, code in zip(timesteps.tolist(), agents.tolist(), codes.tolist())])
 
 
 def convert_malfunctions_to_clingo(malfs, timestep) -> str:
@@ -71,24 +120,24 @@ def convert_malfunctions_to_clingo(malfs, timestep) -> str:
     return(facts)
 
 
-def convert_futures_to_clingo(actions) -> str:
-    # change back to the clingo names
-    mapping = {RailEnvActions.MOVE_FORWARD:"move_forward", RailEnvActions.MOVE_RIGHT:"move_right", RailEnvActions.MOVE_LEFT:"move_left", RailEnvActions.STOP_MOVING:"wait"}
-    for index, dict in enumerate(actions):
-        for key in dict.keys():
-            actions[index][key] = mapping[actions[index][key]]
+def convert_futures_to_clingo(actions) -> list:
+    """ planned actions of an action matrix as planned_action/3 facts """
+    timesteps, agents, codes = actions.entries()
+    return([f'planned_action(train({agent}),{ACTION_NAMES[code]},{timestep}).\n' for timestep, agent, code in zip(timesteps.tolist(), agents.tolist(), codes.tolist())])
 
-    facts = []
-    # change from dictionary into facts
-    for index, dict in enumerate(actions):
-        for key in dict.keys():
-            facts.append(f'planned_action(train({key}),{actions[index][key]},{index}).\n') #remove: can this be a list of strings or should it be one long string?
-    
-    return(facts)
 
-def convert_actions_to_flatland(actions) -> list:
-    mapping = {"move_forward":RailEnvActions.MOVE_FORWARD, "move_right":RailEnvActions.MOVE_RIGHT, "move_left":RailEnvActions.MOVE_LEFT, "wait":RailEnvActions.STOP_MOVING}
-    for index, dict in enumerate(actions):
-        for key in dict.keys():
-            actions[index][key] = mapping[actions[index][key]]
-    return(actions)
\ No newline at end of file
+def convert_formers_to_assumptions(actions) -> list:
+    """
+    executed actions as (action(train(ID), A, T), True) assumptions for a multi-shot replan
+    """
+    timesteps, agents, codes = actions.entries()
+    return([(Function("action", [Function("train", [Number(agent)]), Function(ACTION_NAMES[code]), Number(timestep)]), True)
+            for timestep, agent, code in zip(timesteps.tolist(), agents.tolist(), codes.tolist())])
+
+
+def convert_malfunctions_to_assumptions(malfs, timestep) -> list:
+    """
+    wait actions enforced by malfunctions as (action(train(ID), wait, T), True) assumptions for a multi-shot replan
+    """
+    return([(Function("action", [Function("train", [Number(train)]), Function("wait"), Number(t)]), True)
+            for train, duration in malfs for t in range(timestep+1, timestep+1+duration)])
@@ -0,0 +1,96 @@
+"""
+run several encoding and clingo configurations in parallel and keep the first valid plan
+"""
+
+import os
+import sys
+import copy
+import time
+import multiprocessing as mp
+from queue import Empty
+from clingo.application import clingo_main
+from flatland.envs.malfunction_generators import NoMalfunctionGen
+from modules.api import FlatlandPlan, IncrementalFlatlandPlan
+
+
+def validate_plan(env, actions) -> bool:
+    """ replay the actions on a copy of the environment and check that all trains arrive """
+    env = copy.deepcopy(env)
+    # the plan is open loop, malfunctions are handled by replanning during the simulation
+    env.malfunction_generator = NoMalfunctionGen()
+    for step in actions:
+        _, _, done, _ = env.step(step)
+        if done["__all__"]:
+            break
+    return(all(agent.state.name == "DONE" for agent in env.agents))
+
+
+def run_member(member, env, queue, quiet=True) -> None:
+    """
+    plan with one portfolio member and put (name, status, seconds, actions, stats, model) on the queue
+    status is "valid", "invalid" (the plan does not bring all trains to their targets), "no plan" or "error"
+    """
+    if quiet:
+        # clingo prints through the C library, so the file descriptor itself has to be redirected
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+    start_time = time.time()
+    try:
+        options = member.get("plan_options", {})
+        if member.get("incremental", True):
+            app = IncrementalFlatlandPlan(copy.deepcopy(env), None, **options)
+        else:
+            app = FlatlandPlan(copy.deepcopy(env), None, **options)
+        clingo_main(app, member["primary"] + member.get("arguments", []))
+        if not app.action_list:
+            status = "no plan"
+        else:
+            status = "valid" if validate_plan(env, app.action_list) else "invalid"
+        # clingo symbols cannot be sent to another process
+        model = [str(symbol) for symbol in app.model] if app.model else None
+        queue.put((member["name"], status, time.time() - start_time, app.action_list, app.stats, model))
+    except Exception as e:
+        queue.put((member["name"], "error", time.time() - start_time, None, {"error": repr(e)}, None))
+
+
+def run_portfolio(env, members, timeout=None, quiet=True) -> tuple:
+    """
+    start one process per member and return as soon as the first member found a valid plan; all other members are terminated
+    returns (winner, results): the winning (name, status, seconds, actions, stats, model) tuple or None,
+    and a list of {"name", "status", "seconds"} dicts for all members
+    """
+    queue = mp.Queue()
+    processes = {}
+    start_time = time.time()
+    for member in members:
+        p = mp.Process(target=run_member, args=(member, env, queue, quiet), daemon=True)
+        p.start()
+        processes[member["name"]] = p
+
+    winner = None
+    results = {}
+    while len(results) < len(members):
+        remaining = None if timeout is None else timeout - (time.time() - start_time)
+        if remaining is not None and remaining <= 0:
+            break
+        try:
+            result = queue.get(timeout=remaining)
+        except Empty:
+            break
+        name, status, seconds = result[:3]
+        results[name] = {"name": name, "status": status, "seconds": round(seconds, 2)}
+        print(f"Portfolio member '{name}' finished after {seconds:.2f} seconds: {status}")
+        if status == "valid":
+            winner = result
+            break
+
+    # cancel everything that is still running
+    # (clingo turns SIGTERM into an interrupted solve call and keeps going, so the members are killed)
+    elapsed = round(time.time() - start_time, 2)
+    for name, p in processes.items():
+        if p.is_alive():
+            p.kill()
+        p.join()
+        if name not in results:
+            results[name] = {"name": name, "status": "cancelled", "seconds": elapsed}
+    return(winner, [results[m["name"]] for m in members])
@@ -0,0 +1,156 @@
+"""
+prioritized planning: plan the trains one group at a time, each group avoiding the cells reserved by the groups planned before it
+"""
+
+import copy
+import time
+import numpy as np
+from clingo.application import clingo_main
+from modules.api import FlatlandPlan, IncrementalFlatlandPlan
+from modules.actionlist import ActionMatrix, NO_ACTION
+from modules.convert import convert_formers_to_assumptions
+from modules.reachability import earliest_arrivals
+
+# constraint that keeps a group off the reserved cells, loaded on top of the encodings
+RESERVATIONS = "asp/tk/reservations.lp"
+
+
+def priority_order(env) -> list:
+    """ trains with the longest shortest path first, trains that cannot reach their target last """
+    arrivals = earliest_arrivals(env)
+    return(sorted(range(len(arrivals)), key=lambda a: -1 if arrivals[a] is None else arrivals[a], reverse=True))
+
+
+def sub_env(env, trains):
+    """ shallow copy of the environment that only contains the given trains, train i of the copy is trains[i] """
+    sub = copy.copy(env)
+    sub.agents = [env.agents[a] for a in trains]
+    return(sub)
+
+
+def occupied_cell(symbol) -> tuple:
+    """ (train, cell, timestep) of an occupies(ID, T, C) or occupied(C, ID, T) atom, None for any other symbol """
+    if len(symbol.arguments) != 3:
+        return(None)
+    if symbol.name == "occupies":
+        train, t, c = symbol.arguments
+    elif symbol.name == "occupied":
+        c, train, t = symbol.arguments
+    else:
+        return(None)
+    return(train.number, str(c), t.number)
+
+
+def occupancy(model, trains=None) -> dict:
+    """ train -> (cell, timestep) pairs it occupies, read from the occupancy atoms of a model; train i of the model is trains[i] if given """
+    occupied = {}
+    for symbol in model:
+        cell = occupied_cell(symbol)
+        if cell is not None:
+            train, c, t = cell
+            train = train if trains is None else trains[train]
+            occupied.setdefault(train, set()).add((c, t))
+    return(occupied)
+
+
+def check_occupancy(occupied, trains) -> None:
+    """ every planned train occupies some cell, otherwise the encoding does not define the atoms reservations and conflicts are read from """
+    missing = [train for train in trains if not occupied.get(train)]
+    if missing:
+        raise ValueError(f"The plans of trains {missing} have no occupies/3 or occupied/3 atoms, load an encoding that defines them")
+
+
+def first_conflict(occupancy) -> tuple:
+    """
+    the earliest (timestep, cell, train, other train) at which two trains occupy the same cell, None if the plans are conflict free
+    moves occupy both cells, so trains swapping cells are found as well
+    """
+    seen = {}
+    conflict = None
+    for train, cells in occupancy.items():
+        for cell, t in cells:
+            other = seen.setdefault((cell, t), train)
+            if other != train and (conflict is None or t < conflict[0]):
+                conflict = (t, cell, other, train)
+    return(conflict)
+
+
+class PrioritizedPlan():
+    """
+    plans groups of `group_size` trains in priority order with FlatlandPlan or IncrementalFlatlandPlan
+    the cells and timesteps occupied by earlier groups are passed to later groups as reserved/2 facts
+    the merged plan is checked for collisions, so an encoding whose reservations do not hold is reported instead of returning colliding plans
+    if a group cannot be planned, planning restarts with that group moved to the front of the order, at most `max_restarts` times
+    """
+    def __init__(self, env, files, group_size=1, incremental=True, max_restarts=5, order=None, plan_options=None):
+        self.env = env
+        self.files = list(files) + [RESERVATIONS]
+        self.group_size = group_size
+        self.incremental = incremental
+        self.max_restarts = max_restarts
+        self.order = order
+        # keyword arguments of FlatlandPlan / IncrementalFlatlandPlan, the models have to contain the occupies/3 or occupied/3 atoms
+        self.plan_options = dict(plan_options if plan_options is not None else {}, extract="atoms")
+        self.action_list = None
+        self.model = None
+        self.stats = {"restarts": 0, "groups": []}
+
+    def plan_group(self, trains, reserved):
+        """ plan the given trains around the reserved cells, returns the app (with action_list None if there is no plan) """
+        facts = [f"reserved({c},{t})." for c, t in sorted(reserved)]
+        env = sub_env(self.env, trains)
+        if self.incremental:
+            app = IncrementalFlatlandPlan(env, facts, **self.plan_options)
+        else:
+            app = FlatlandPlan(env, facts, **self.plan_options)
+        clingo_main(app, self.files + ["--outf=3"])
+        return(app)
+
+    def plan(self) -> ActionMatrix:
+        """ plan all trains, returns the joint action matrix or None if no order led to a plan """
+        start_time = time.time()
+        order = list(self.order) if self.order is not None else priority_order(self.env)
+        for attempt in range(self.max_restarts + 1):
+            groups = [order[i:i + self.group_size] for i in range(0, len(order), self.group_size)]
+            reserved, plans, occupied = set(), [], {}
+            failed = None
+            for trains in groups:
+                group_time = time.time()
+                app = self.plan_group(trains, reserved)
+                self.stats["groups"].append({"attempt": attempt, "trains": trains, "seconds": round(time.time() - group_time, 2),
+                                             "reserved": len(reserved), "planned": app.action_list is not None})
+                if app.action_list is None:
+                    failed = trains
+                    break
+                group = occupancy(app.model, trains)
+                check_occupancy(group, trains)
+                for cells in group.values():
+                    reserved |= cells
+                occupied.update(group)
+                plans.append((trains, app.action_list))
+            if failed is None:
+                conflict = first_conflict(occupied)
+                if conflict is not None:
+                    t, cell, first, second = conflict
+                    raise Exception(f"Prioritized plans of trains {first} and {second} collide in cell {cell} at timestep {t}, the reservations do not hold for the encoding.")
+                self.action_list = merge_plans(plans, len(self.env.agents))
+                # the models of the groups number their trains from 0, so only the action/3 atoms are kept, with the original train numbers
+                self.model = [symbol for symbol, _ in convert_formers_to_assumptions(self.action_list)]
+                break
+            if failed == groups[0]:
+                print(f"Prioritized planning failed for trains {failed} without any reservations.")
+                break
+            print(f"Prioritized planning failed for trains {failed}, restarting with them first.")
+            self.stats["restarts"] += 1
+            order = failed + [a for a in order if a not in failed]
+        self.stats["running_time"] = f"{time.time() - start_time:.2f}"
+        return(self.action_list)
+
+
+def merge_plans(plans, num_agents) -> ActionMatrix:
+    """ combine the action matrices of the groups into one, the columns of a group matrix belong to the trains of the group """
+    length = max((len(actions) for _, actions in plans), default=0)
+    matrix = np.full((length, num_agents), NO_ACTION, dtype=np.int8)
+    for trains, actions in plans:
+        matrix[:len(actions), trains] = actions.matrix
+    return(ActionMatrix(matrix))
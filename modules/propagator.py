@@ -0,0 +1,48 @@
+"""
+occupancy conflicts checked by a clingo propagator instead of a grounded constraint over all pairs of trains
+"""
+
+from collections import defaultdict
+
+
+class OccupancyPropagator:
+    """
+    replaces `:- occupies(ID0, T, C), occupies(ID1, T, C), ID0 < ID1.`
+    occupies/3 literals are indexed by (cell, timestep); once one becomes true, the literals of the other trains at the same
+    cell and timestep that are true as well are reported as a conflict, so only the pairs that actually clash are ever added
+    """
+    def __init__(self):
+        # (cell, timestep) -> [(literal, train)] and literal -> [((cell, timestep), train)]
+        self.cells = defaultdict(list)
+        self.literals = defaultdict(list)
+        self.conflicts = 0
+
+    def init(self, init):
+        # called before every solve call, the symbolic atoms include those of all steps grounded so far
+        self.cells.clear()
+        self.literals.clear()
+        for atom in init.symbolic_atoms.by_signature("occupies", 3):
+            train, t, cell = atom.symbol.arguments
+            lit = init.solver_literal(atom.literal)
+            key = (str(cell), t.number)
+            self.cells[key].append((lit, train.number))
+            self.literals[lit].append((key, train.number))
+        for lit in self.literals:
+            init.add_watch(lit)
+        # literals that are true from the start (e.g. trains waiting at their start cell) rule out the other trains right away
+        for key, occupants in self.cells.items():
+            for lit, train in occupants:
+                if init.assignment.is_true(lit):
+                    for other, other_train in occupants:
+                        if other_train != train and not init.add_clause([-other]):
+                            return
+
+    def propagate(self, control, changes):
+        assignment = control.assignment
+        for lit in changes:
+            for key, train in self.literals[lit]:
+                for other, other_train in self.cells[key]:
+                    if other_train != train and assignment.is_true(other):
+                        self.conflicts += 1
+                        if not control.add_nogood([lit, other]) or not control.propagate():
+                            return
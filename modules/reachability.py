@@ -0,0 +1,154 @@
+"""
+per-train reachability on the directed rail graph and the time windows derived from it
+"""
+
+import os
+from collections import deque
+from clingo.symbol import Function, Number, Tuple_
+from modules.convert import agent_facts
+from modules.transitions import cell_conn_facts
+
+# deadlines for the latest timestep at which a train can still be at a state
+# horizon: the train has to arrive by the end of the episode, global(MaxT) (does not cut off any plan)
+# latest_arrival: the train has to arrive by its latest arrival, end(ID, C, MaxEnd) (may make instances with delays unsatisfiable)
+DEADLINES = ["horizon", "latest_arrival"]
+
+
+def state_graph(env) -> dict:
+    """
+    successors of every state (cell, direction) of the rail graph, following the move actions of cell_conn/5
+    """
+    graph = {}
+    for a, c0, d_in, c1, d_out in cell_conn_facts(env):
+        if a != "wait":
+            graph.setdefault((c0, d_in), []).append((c1, d_out))
+    return(graph)
+
+
+def reverse_graph(graph) -> dict:
+    """ predecessors of every state of the rail graph """
+    reverse = {}
+    for state, successors in graph.items():
+        for succ in successors:
+            reverse.setdefault(succ, []).append(state)
+    return(reverse)
+
+
+def bfs(graph, sources, blocked=()) -> dict:
+    """
+    number of moves from the closest source to every reachable state
+    states whose cell is in `blocked` are reached but not expanded
+    """
+    dist = {s: 0 for s in sources}
+    queue = deque(sources)
+    while queue:
+        state = queue.popleft()
+        if state[0] in blocked:
+            continue
+        for succ in graph.get(state, ()):
+            if succ not in dist:
+                dist[succ] = dist[state] + 1
+                queue.append(succ)
+    return(dist)
+
+
+def target_states(graph, target) -> list:
+    """ all states of the rail graph located at the target cell """
+    states = {s for s in graph if s[0] == target}
+    states.update(succ for successors in graph.values() for succ in successors if succ[0] == target)
+    return(sorted(states))
+
+
+def reach_windows(env, deadline="horizon") -> list:
+    """
+    compute reach(ID, C, Dir, E, L) tuples: train ID can only be at cell C facing Dir from timestep E to timestep L
+    E: the train enters its start cell at departure and needs `speed` timesteps per move afterwards
+    L: from C facing Dir, the train still has to make the shortest path to its target before the deadline
+    states that are unreachable from the start, cannot reach the target or have an empty window are dropped
+    """
+    if deadline not in DEADLINES:
+        raise ValueError(f"Unknown deadline '{deadline}', expected one of {DEADLINES}")
+
+    graph = state_graph(env)
+    reverse = reverse_graph(graph)
+    max_time = env._max_episode_steps
+    windows = []
+    for agent_num, start, min_start, direction, target, max_end, speed in agent_facts(env):
+        limit = max_time if deadline == "horizon" else min(max_end, max_time)
+        # trains stop at their target, so the search does not continue beyond it
+        forward = bfs(graph, [(start, direction)], blocked={target})
+        backward = bfs(reverse, target_states(graph, target))
+        for state, d_from in forward.items():
+            if state not in backward:
+                continue
+            earliest = min_start + 1 + d_from * speed
+            latest = limit - backward[state] * speed
+            if earliest <= latest:
+                windows.append((agent_num, state[0], state[1], earliest, latest))
+    return(windows)
+
+
+def write_reach(windows, out) -> None:
+    """
+    writes the reach(ID, C, Dir, E, L) facts to a file path or an open stream
+    """
+    if isinstance(out, (str, os.PathLike)):
+        with open(out, "w") as f:
+            write_reach(windows, f)
+        return
+    out.write("".join(f"reach({a},({y},{x}),{d},{e},{l}).\n" for a, (y, x), d, e, l in windows))
+
+
+def load_reach(ctl, windows) -> int:
+    """
+    adds the reach facts as symbols through the clingo backend
+    returns the number of facts added
+    """
+    numbers, cells, names = {}, {}, {}
+    def num(n):
+        if n not in numbers:
+            numbers[n] = Number(n)
+        return(numbers[n])
+    def cell(c):
+        if c not in cells:
+            cells[c] = Tuple_([num(c[0]), num(c[1])])
+        return(cells[c])
+    def name(n):
+        if n not in names:
+            names[n] = Function(n)
+        return(names[n])
+
+    with ctl.backend() as backend:
+        for a, c, d, e, l in windows:
+            backend.add_rule([backend.add_atom(Function("reach", [num(a), cell(c), name(d), num(e), num(l)]))])
+    return(len(windows))
+
+
+def earliest_arrivals(env) -> list:
+    """
+    earliest timestep at which each train can arrive at its target, ignoring all other trains
+    the train enters its start cell at departure (at timestep 1 if it departs at 0), is there one timestep later
+    and needs `speed` timesteps for each move of the shortest path; None if the target cannot be reached
+    """
+    graph = state_graph(env)
+    arrivals = []
+    for agent_num, start, min_start, direction, target, max_end, speed in agent_facts(env):
+        forward = bfs(graph, [(start, direction)], blocked={target})
+        moves = [d for (cell, _), d in forward.items() if cell == target]
+        arrivals.append(max(min_start, 1) + 1 + min(moves) * speed if moves else None)
+    return(arrivals)
+
+
+
+def target_distances(env) -> list:
+    """
+    dist(ID, C, Dir, D) tuples: train ID needs D timesteps (`speed` per move) from cell C facing Dir to its target, ignoring all other trains
+    states from which the target cannot be reached are left out
+    """
+    graph = state_graph(env)
+    reverse = reverse_graph(graph)
+    distances = []
+    for agent_num, start, min_start, direction, target, max_end, speed in agent_facts(env):
+        backward = bfs(reverse, target_states(graph, target))
+        distances.extend((agent_num, cell, d, moves * speed) for (cell, d), moves in backward.items())
+    return(distances)
@@ -0,0 +1,87 @@
+"""
+local repair: after a malfunction, replan only the trains whose future cells clash with the delayed train and keep the plans of all others
+"""
+
+import time
+from clingo import parse_term
+from modules.api import FlatlandReplan
+from modules.actionlist import ActionMatrix
+from modules.convert import convert_formers_to_assumptions, convert_malfunctions_to_assumptions
+from modules.prioritized import RESERVATIONS, sub_env, occupancy, merge_plans
+
+
+def delayed_occupancy(cells, timestep, duration) -> set:
+    """
+    the (cell, timestep) pairs after `timestep` of a train that breaks down at `timestep` for `duration` timesteps
+    it stays on the cells it occupies at `timestep` and then follows its old plan `duration` timesteps later
+    """
+    held = {(c, t) for c, t0 in cells if t0 == timestep for t in range(timestep + 1, timestep + duration + 1)}
+    later = {(c, t + duration) for c, t in cells if t > timestep}
+    return(held | later)
+
+
+def affected_trains(occupied, broken, timestep) -> list:
+    """
+    the broken trains (train -> malfunction duration) and all trains that occupy one of their delayed cells at the same timestep after `timestep`
+    """
+    delayed = set()
+    for train, duration in broken.items():
+        delayed |= delayed_occupancy(occupied.get(train, ()), timestep, duration)
+    affected = set(broken)
+    for train, cells in occupied.items():
+        if train not in affected and any(t > timestep and (c, t) in delayed for c, t in cells):
+            affected.add(train)
+    return(sorted(affected))
+
+
+class LocalRepair():
+    """
+    repairs a plan after malfunctions by replanning the affected trains with FlatlandReplan on an environment that only contains them
+    the cells of all other trains from the current timestep on are passed as reserved/2 facts and their actions are kept,
+    so the replanned program grows with the disruption and not with the fleet
+    `model` is the model of the plan, it has to contain the occupies/3 or occupied/3 atoms
+    """
+    def __init__(self, env, files, model, incremental=True, warm_start=None, plan_options=None):
+        self.env = env
+        self.files = list(files) + [RESERVATIONS]
+        self.incremental = incremental
+        self.warm_start = warm_start
+        # keyword arguments of FlatlandReplan, the models have to contain the occupies/3 or occupied/3 atoms
+        self.plan_options = dict(plan_options if plan_options is not None else {}, extract="atoms")
+        self.occupied = occupancy(model)
+        self.model = None
+        self.stats = []
+
+    def repair(self, actions, timestep, malfunctions, broken) -> ActionMatrix:
+        """
+        replan the trains affected by the new malfunctions `broken` (train -> duration) that occurred at `timestep`
+        `malfunctions` are all current (train, duration) pairs, as given by the MalfunctionManager
+        returns the repaired action matrix, or None if the affected trains cannot be planned around the kept ones
+        """
+        start_time = time.time()
+        trains = affected_trains(self.occupied, broken, timestep)
+        index = {train: i for i, train in enumerate(trains)}
+        kept = [train for train in range(len(self.env.agents)) if train not in index]
+        reserved = {(c, t) for train in kept for c, t in self.occupied.get(train, ()) if t >= timestep}
+
+        # the trains of the sub environment are numbered from 0, so past actions and malfunctions are renumbered as well
+        past = convert_formers_to_assumptions(ActionMatrix(actions.matrix[:timestep, trains]))
+        present = convert_malfunctions_to_assumptions([(index[train], d) for train, d in malfunctions if train in index], timestep)
+        replanner = FlatlandReplan(sub_env(self.env, trains), self.files, incremental=self.incremental, warm_start=self.warm_start,
+                                   actions=[f"reserved({c},{t})." for c, t in sorted(reserved)], **self.plan_options)
+        repaired = replanner.replan(past + present, horizon=len(actions), hints=ActionMatrix(actions.matrix[:, trains]))
+
+        self.stats.append({"timestep": timestep, "broken": sorted(broken), "replanned": trains, "reserved": len(reserved),
+                           "running_time": f"{time.time() - start_time:.2f}", "repaired": repaired is not None})
+        print(f"Local repair {'replanned' if repaired is not None else 'could not replan'} {len(trains)} of {len(self.env.agents)} trains in {time.time() - start_time:.2f} seconds.")
+        if repaired is None:
+            return(None)
+
+        replanned = occupancy(replanner.model, trains)
+        for train in trains:
+            self.occupied[train] = replanned.get(train, set())
+        merged = merge_plans([(kept, ActionMatrix(actions.matrix[:, kept])), (trains, repaired)], len(self.env.agents))
+        # action/3 atoms with the original train numbers, and the occupies/3 atoms the next repair starts from
+        self.model = [symbol for symbol, _ in convert_formers_to_assumptions(merged)] + \
+                     [parse_term(f"occupies({train},{t},{c})") for train, cells in sorted(self.occupied.items()) for c, t in sorted(cells)]
+        return(merged)
@@ -0,0 +1,114 @@
+"""
+rolling-horizon planning: plan a window of the next timesteps from the current state of the environment, commit its first steps and plan again
+"""
+
+import io
+import time
+import numpy as np
+import clingo
+from modules.api import configure_threads, model_symbols
+from modules.actionlist import ActionMatrix, build_action_matrix
+from modules.cache import cached
+from modules.convert import agent_facts
+from modules.reachability import target_distances
+from modules.transitions import cell_conn_facts, load_cell_conn, DIRECTIONS
+from modules.trace import span
+
+ROLLING = "asp/tk/encoding_rolling.lp"
+# Flatland's RailEnvActions values of the actions a train may have saved for its current move
+SAVED_ACTIONS = {1: "move_left", 2: "move_forward", 3: "move_right"}
+
+
+def window_state(env, offset, conn) -> list:
+    """
+    the facts of encoding_rolling.lp that describe the trains at global timestep `offset`, see the encoding for their meaning
+    trains that are done are left out, `conn` are the cell_conn tuples of the environment
+    """
+    moves = {(a, c0, d_in): (c1, d_out) for a, c0, d_in, c1, d_out in conn}
+    facts = []
+    for (agent_num, start, min_start, direction, target, max_end, speed), agent in zip(agent_facts(env), env.agents):
+        if agent.state.name == "DONE":
+            continue
+        facts.append(f"train({agent_num}). end({agent_num},{target},{max_end - offset}). speed({agent_num},{speed}).")
+        down = agent.malfunction_handler.malfunction_down_counter
+        if agent.position is None:
+            # the toolkit expects a wait action at the very first timestep, as in the other encodings
+            dep = max(min_start - offset, down, 1 if offset == 0 else 0)
+            facts.append(f"start({agent_num},{start},{dep},{direction}).")
+            continue
+        cell, facing = tuple(agent.position), DIRECTIONS[agent.direction]
+        holds = ["wait"] * down
+        target_cell, target_dir = cell, facing
+        # a slow train in the middle of a move keeps moving until it reaches the next cell
+        counter = agent.speed_counter
+        action = SAVED_ACTIONS.get(agent.action_saver.saved_action.value) if agent.action_saver.is_action_saved else None
+        if counter.counter > 0 and (action, cell, facing) in moves:
+            target_cell, target_dir = moves[(action, cell, facing)]
+            holds += [action] * (counter.max_count - counter.counter + 1)
+        facts.append(f"position({agent_num},{cell},{target_cell},{target_dir},{len(holds)}).")
+        facts.extend(f"hold({agent_num},{a},{t})." for t, a in enumerate(holds))
+    return(facts)
+
+
+def append_actions(actions, window, start, commit) -> ActionMatrix:
+    """ the actions before global timestep `start` followed by the first `commit` timesteps of the window """
+    return(ActionMatrix(np.vstack([actions.matrix[:start], window.matrix[:commit]])))
+
+
+class RollingPlan():
+    """
+    plans `window` timesteps ahead from the current state of the environment with encoding_rolling.lp
+    every window is grounded on a new control object, so memory and latency depend on the window and not on the episode length
+    optimization stops after `budget` seconds (if given) and keeps the best plan of the window found so far
+    """
+    def __init__(self, env, window=32, commit=8, budget=None, wait="always", cache=None, threads=None, parallel_mode="compete"):
+        if not 0 < commit <= window:
+            raise ValueError(f"The committed steps ({commit}) have to be between 1 and the window size ({window})")
+        self.env = env
+        self.window = window
+        self.commit = commit
+        self.budget = budget
+        self.wait = wait
+        self.cache = cache
+        self.threads = threads
+        self.parallel_mode = parallel_mode
+        self.model = None
+        self.stats = []
+
+    def plan_window(self, offset) -> ActionMatrix:
+        """ plan the window starting at global timestep `offset`, returns its action matrix (starting at row 0) or None """
+        start_time = time.time()
+        env = self.env
+        conn = cached(self.cache, env, ("cell_conn", self.wait), lambda: cell_conn_facts(env, self.wait))
+        distances = cached(self.cache, env, "target_distances", lambda: target_distances(env))
+        window = min(self.window, env._max_episode_steps - offset)
+
+        ctl = clingo.Control(["--warn=none"])
+        configure_threads(ctl, self.threads, self.parallel_mode)
+        ctl.load(ROLLING)
+        facts = io.StringIO()
+        facts.write(f"global({window}). max_dist({max((d for *_, d in distances), default=0) + 1}).\n")
+        facts.write("\n".join(window_state(env, offset, conn)) + "\n")
+        facts.write("".join(f"dist({a},{c},{d},{n}).\n" for a, c, d, n in distances))
+        with span("ground window", offset=offset):
+            load_cell_conn(ctl, env, facts=conn)
+            ctl.add("base", [], facts.getvalue())
+            ctl.ground([("base", [])])
+        ground_time = time.time() - start_time
+
+        model = None
+        def on_model(m):
+            nonlocal model
+            model = model_symbols(m)
+        with span("solve window", offset=offset), ctl.solve(async_=True, on_model=on_model) as handle:
+            if not handle.wait(self.budget):
+                handle.cancel()
+            result = handle.get()
+
+        self.stats.append({"offset": offset, "window": window, "ground_time": round(ground_time, 3),
+                           "solve_time": round(time.time() - start_time - ground_time, 3), "result": str(result)})
+        print(f"Window at timestep {offset} planned in {time.time() - start_time:.2f} seconds: {result}")
+        if model is None:
+            return(None)
+        self.model = model
+        return(build_action_matrix(model, len(env.agents)))
@@ -1,14 +1,14 @@
 # functions for saving a Flatland environment as various file types
 
 from flatland.utils.rendertools import RenderTool, AgentRenderVariant
+from modules.convert import write_clingo
 import pickle
 
 def save_lp(env, file_name, file_location):
     """ 
     save the clingo representation as an .lp file to be loaded later 
     """
-    with open(f"{file_location}lp/{file_name}.lp", "w") as f:
-        f.write(env)
+    write_clingo(env, f"{file_location}lp/{file_name}.lp", skip_empty=False)
 
 
 def save_png(env, file_name, file_location):
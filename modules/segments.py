@@ -0,0 +1,107 @@
+"""
+contract chains of non-branching cells into segments of the rail graph
+"""
+
+import os
+import numpy as np
+from dataclasses import dataclass
+from clingo.symbol import Function, Number, Tuple_
+from modules.transitions import cell_conn_facts, decode_transitions, straight_cells
+
+
+@dataclass
+class Segment:
+    """
+    A path from a boundary cell to the next boundary cell.
+    The train leaves `start` facing `in_dir` via `actions[0]` and moves forward through the corridor
+    until it reaches `end` facing `out_dir`.
+    `cells` lists all cells of the path including both boundary cells, so len(cells) == length + 1.
+    """
+    sid: int
+    start: tuple
+    in_dir: str
+    end: tuple
+    out_dir: str
+    cells: list
+    actions: list
+
+    @property
+    def length(self) -> int:
+        return(len(self.actions))
+
+
+def boundary_cells(env) -> set:
+    """
+    cells at which a train may stop to decide: every cell that is not a plain straight track or bend,
+    as well as the start and target cells of all agents
+    """
+    grid = np.asarray(env.rail.grid)
+    straight = straight_cells(decode_transitions(grid))
+    ys, xs = ((grid != 0) & ~straight).nonzero()
+    boundary = set(zip(ys.tolist(), xs.tolist()))
+    for agent in env.agents:
+        boundary.add(tuple(agent.initial_position))
+        boundary.add(tuple(agent.target))
+    return(boundary)
+
+
+def build_segments(env) -> list:
+    """
+    follow every exit of every boundary cell through the corridor behind it until the next boundary cell is reached
+    paths that run into a dead end or loop back without reaching a boundary cell are dropped
+    """
+    moves = {}
+    for a, c0, d_in, c1, d_out in cell_conn_facts(env):
+        if a != "wait":
+            moves.setdefault((c0, d_in), []).append((a, c1, d_out))
+
+    boundary = boundary_cells(env)
+    max_length = len(moves) + 1
+    segments = []
+    for (c0, d_in), exits in sorted(moves.items()):
+        if c0 not in boundary:
+            continue
+        for a, c1, d_out in exits:
+            cells, actions = [c0, c1], [a]
+            while c1 not in boundary and len(actions) <= max_length:
+                following = moves.get((c1, d_out), [])
+                if len(following) != 1:
+                    break
+                a, c1, d_out = following[0]
+                cells.append(c1)
+                actions.append(a)
+            if c1 in boundary:
+                segments.append(Segment(len(segments), c0, d_in, c1, d_out, cells, actions))
+    return(segments)
+
+
+def write_segments(segments, out) -> None:
+    """
+    writes segment(SID, C0, In, C1, Out, Len) and segment_cell(SID, K, C) facts to a file path or an open stream
+    """
+    if isinstance(out, (str, os.PathLike)):
+        with open(out, "w") as f:
+            write_segments(segments, f)
+        return
+    for seg in segments:
+        (y0, x0), (y1, x1) = seg.start, seg.end
+        out.write(f"segment({seg.sid},({y0},{x0}),{seg.in_dir},({y1},{x1}),{seg.out_dir},{seg.length}).\n")
+        out.write("".join(f"segment_cell({seg.sid},{k},({y},{x})).\n" for k, (y, x) in enumerate(seg.cells)))
+
+
+def load_segments(ctl, segments) -> int:
+    """
+    adds the segment facts as symbols through the clingo backend
+    returns the number of facts added
+    """
+    count = 0
+    with ctl.backend() as backend:
+        for seg in segments:
+            sid = Number(seg.sid)
+            cells = [Tuple_([Number(y), Number(x)]) for y, x in seg.cells]
+            facts = [Function("segment", [sid, cells[0], Function(seg.in_dir), cells[-1], Function(seg.out_dir), Number(seg.length)])]
+            facts += [Function("segment_cell", [sid, Number(k), cell]) for k, cell in enumerate(cells)]
+            for fact in facts:
+                backend.add_rule([backend.add_atom(fact)])
+            count += len(facts)
+    return(count)
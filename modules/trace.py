@@ -0,0 +1,50 @@
+"""
+nested timing spans of a run, saved in the Chrome trace event format (open in chrome://tracing or https://ui.perfetto.dev)
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Tracer():
+    """
+    collects one complete event per span, spans that are opened within another span are shown nested below it
+    nothing is recorded until the tracer is enabled
+    """
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.origin = time.perf_counter()
+
+    def enable(self) -> None:
+        """ start recording, timestamps are relative to this call """
+        self.enabled = True
+        self.events = []
+        self.origin = time.perf_counter()
+
+    @contextmanager
+    def span(self, name, **args):
+        """ time the enclosed block as the span `name`, keyword arguments are shown with the span """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.events.append({"name": name, "ph": "X", "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6,
+                                "pid": os.getpid(), "tid": threading.get_ident(), "args": args})
+
+    def save(self, path) -> None:
+        """ write the recorded spans as a Chrome trace JSON file """
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f, default=str)
+
+
+# tracer of the current process
+tracer = Tracer()
+span = tracer.span
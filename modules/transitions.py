@@ -0,0 +1,112 @@
+"""
+decode the 16-bit transition values of the rail grid into ready-made cell_conn facts
+"""
+
+import os
+import numpy as np
+from clingo.symbol import Function, Number, Tuple_
+
+# Flatland orders directions clockwise: 0 = North, 1 = East, 2 = South, 3 = West
+DIRECTIONS = ["n", "e", "s", "w"]
+# move(D, Y, X): moving in direction D changes grid location by Y (row) and X (column)
+MOVES = [(-1, 0), (0, 1), (1, 0), (0, -1)]
+
+# wait policies of the tracks*.lp files
+# always: trains can wait on any type 1 (straight or bend) cell, as in tracks_incremental.lp
+# before_switch: trains can wait on type 1 cells whose next cell is not of type 1, as in tracks_transition.lp
+WAIT_POLICIES = ["always", "before_switch"]
+
+
+def decode_transitions(grid) -> np.ndarray:
+    """
+    decode the rail grid into a boolean array of shape (height, width, 4, 4)
+    entry [y, x, In, Out] is set if a train facing In at cell (y, x) can leave it facing Out
+    each cell stores one nibble per incoming direction (North first), each nibble has one bit per outgoing direction (North first)
+    """
+    grid = np.asarray(grid, dtype=np.uint16)
+    shifts = 15 - (4 * np.arange(4)[:, None] + np.arange(4)[None, :])
+    return(((grid[..., None, None] >> shifts) & 1).astype(bool))
+
+
+def straight_cells(transitions) -> np.ndarray:
+    """
+    mark the type 1 cells (straight tracks and bends): exactly two incoming directions, each with a single exit
+    """
+    exits = transitions.sum(axis=3)
+    return(((exits == 1).sum(axis=2) == 2) & (exits.max(axis=2) == 1))
+
+
+def cell_conn_facts(env, wait="always") -> list:
+    """
+    compute all cell_conn(A, C0, In, C1, Out) tuples of the environment, with cells as (y, x) tuples and directions as letters
+    a single exit is always reached via move_forward, otherwise the action depends on the turn relative to In
+    """
+    if wait not in WAIT_POLICIES:
+        raise ValueError(f"Unknown wait policy '{wait}', expected one of {WAIT_POLICIES}")
+
+    grid = np.asarray(env.rail.grid)
+    transitions = decode_transitions(grid)
+    straight = straight_cells(transitions)
+    height, width = grid.shape
+
+    ys, xs, d_in, d_out = np.nonzero(transitions)
+    single = transitions.sum(axis=3)[ys, xs, d_in] == 1
+    # 0 = move_forward, 1 = move_left, 2 = move_right, -1 = reversal (only possible in dead ends, which have a single exit)
+    action = np.select([single | (d_out == d_in), d_out == (d_in - 1) % 4, d_out == (d_in + 1) % 4], [0, 1, 2], -1)
+    keep = action >= 0
+    ys, xs, d_in, d_out, action = ys[keep], xs[keep], d_in[keep], d_out[keep], action[keep]
+    moves = np.array(MOVES)
+    y1, x1 = ys + moves[d_out, 0], xs + moves[d_out, 1]
+
+    # wait actions on type 1 cells, depending on the policy
+    can_wait = straight[ys, xs]
+    if wait == "before_switch":
+        inside = (y1 >= 0) & (y1 < height) & (x1 >= 0) & (x1 < width)
+        y1c, x1c = np.clip(y1, 0, height - 1), np.clip(x1, 0, width - 1)
+        can_wait &= inside & (grid[y1c, x1c] != 0) & ~straight[y1c, x1c]
+
+    actions = ["move_forward", "move_left", "move_right"]
+    facts = [(actions[a], (y, x), DIRECTIONS[i], (yy, xx), DIRECTIONS[o])
+             for a, y, x, i, yy, xx, o in zip(action.tolist(), ys.tolist(), xs.tolist(), d_in.tolist(), y1.tolist(), x1.tolist(), d_out.tolist())]
+    facts += [("wait", (y, x), DIRECTIONS[i], (y, x), DIRECTIONS[i])
+              for y, x, i in set(zip(ys[can_wait].tolist(), xs[can_wait].tolist(), d_in[can_wait].tolist()))]
+    return(facts)
+
+
+def write_cell_conn(env, out, wait="always", facts=None) -> None:
+    """
+    writes the cell_conn facts of the environment to a file path or an open stream
+    already computed `facts` (e.g. from a cache) are written instead of decoding the grid again
+    """
+    if isinstance(out, (str, os.PathLike)):
+        with open(out, "w") as f:
+            write_cell_conn(env, f, wait=wait, facts=facts)
+        return
+    if facts is None:
+        facts = cell_conn_facts(env, wait)
+    out.write("".join(f"cell_conn({a},({y0},{x0}),{d_in},({y1},{x1}),{d_out}).\n" for a, (y0, x0), d_in, (y1, x1), d_out in facts))
+
+
+def load_cell_conn(ctl, env, wait="always", facts=None) -> int:
+    """
+    adds the cell_conn facts of the environment as symbols through the clingo backend
+    already computed `facts` (e.g. from a cache) are added instead of decoding the grid again
+    returns the number of facts added
+    """
+    if facts is None:
+        facts = cell_conn_facts(env, wait)
+    cells, names = {}, {}
+    def cell(c):
+        if c not in cells:
+            cells[c] = Tuple_([Number(c[0]), Number(c[1])])
+        return(cells[c])
+    def name(n):
+        if n not in names:
+            names[n] = Function(n)
+        return(names[n])
+
+    with ctl.backend() as backend:
+        for a, c0, d_in, c1, d_out in facts:
+            atom = backend.add_atom(Function("cell_conn", [name(a), cell(c0), name(d_in), cell(c1), name(d_out)]))
+            backend.add_rule([atom])
+    return(len(facts))
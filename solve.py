@@ -9,7 +9,7 @@ from argparse import ArgumentParser, Namespace
 # custom modules
 from asp import params
 from modules.api import FlatlandPlan, FlatlandReplan
-from modules.convert import convert_malfunctions_to_clingo, convert_formers_to_clingo, convert_futures_to_clingo
+from modules.convert import convert_formers_to_assumptions, convert_malfunctions_to_assumptions
 from html_viz import grid_json, train_info, LandscapeBuilder, generate_html
 
 from flatland.envs.rail_env_action import RailEnvActions
@@ -69,6 +69,8 @@ class SimulationManager():
             self.secondary = secondary
         self.model = None
         self.stats = None
+        self.actions = None
+        self.replanner = None
 
     def build_actions(self) -> list:
         """ create initial list of actions """
@@ -77,24 +79,29 @@ class SimulationManager():
         clingo_main(app, self.primary)
         self.stats = app.stats
         self.model = app.model
+        self.actions = app.action_list
         return(app.action_list)
 
-    def provide_context(self, actions, timestep, malfunctions) -> str:
-        """ provide additional facts when updating list """
+    def provide_context(self, actions, timestep, malfunctions) -> list:
+        """ provide assumptions when updating list """
         # actions that have already been executed
         # wait actions that are enforced because of malfunctions
-        # future actions that were previously planned
-        past = convert_formers_to_clingo(actions[:timestep])
-        present = convert_malfunctions_to_clingo(malfunctions, timestep)
-        future = convert_futures_to_clingo(actions[timestep:])
-        return(past + present + future)
+        past = convert_formers_to_assumptions(actions[:timestep])
+        present = convert_malfunctions_to_assumptions(malfunctions, timestep)
+        return(past + present)
 
     def update_actions(self, context) -> list:
         """ update list of actions following malfunction """
-        # pass env, secondary, context
-        app = FlatlandPlan(self.env, context)
-        clingo_main(app, self.primary)
-        return(app.action_list)
+        # the replanner keeps its control object, so the environment is only grounded once per simulation
+        if self.replanner is None:
+            self.replanner = FlatlandReplan(self.env, self.primary, incremental=False)
+        actions = self.replanner.replan(context, horizon=len(self.actions))
+        if actions is None:
+            warnings.warn('Replanning failed, continuing with the previous list of actions.')
+            return(self.actions)
+        self.model = self.replanner.model
+        self.actions = actions
+        return(actions)
 
 
 class OutputLogManager():
@@ -9,8 +9,14 @@ from argparse import ArgumentParser, Namespace
 
 # custom modules
 from asp import params
-from modules.api import FlatlandPlan, FlatlandReplan, IncrementalFlatlandPlan
-from modules.convert import convert_malfunctions_to_clingo, convert_formers_to_clingo, convert_futures_to_clingo
+from modules.api import FlatlandPlan, FlatlandReplan, IncrementalFlatlandPlan, FactCache, GroundProgramCache, FACT_LOADERS, HORIZON_STRATEGIES, WAIT_POLICIES, DEADLINES, REPLAN_OPTIONS, PARALLEL_MODES, SOLVE_MODES, WARM_STARTS
+from modules.convert import convert_formers_to_assumptions, convert_malfunctions_to_assumptions
+from modules.portfolio import run_portfolio
+from modules.prioritized import PrioritizedPlan, occupancy
+from modules.cbs import ConflictBasedPlan
+from modules.rolling import RollingPlan, append_actions
+from modules.repair import LocalRepair
+from modules.trace import tracer, span
 from html_viz import grid_json, train_info, LandscapeBuilder, generate_html
 
 from flatland.envs.rail_env_action import RailEnvActions
@@ -70,7 +76,7 @@ class MalfunctionManager():
         return(new)
     
 class IncrementalSimulationManager():
-    def __init__(self, env, primary, secondary=None, optimize=False):
+    def __init__(self, env, primary, secondary=None, optimize=False, plan_options=None, warm_start=None):
         self.env = env
         self.primary = primary
         if secondary is None:
@@ -78,72 +84,292 @@ class IncrementalSimulationManager():
         else:
             self.secondary = secondary
         self.optimize = optimize
+        # keyword arguments passed on to every FlatlandPlan / IncrementalFlatlandPlan
+        self.plan_options = plan_options if plan_options is not None else {}
+        # how the replanner steers the solver towards the previous plan (see WARM_STARTS), None for no warm start
+        self.warm_start = warm_start
         self.model = None
         self.stats = None
+        self.actions = None
+        self.replanner = None
 
     def build_actions(self) -> list:
         """ create initial list of actions """
         # pass env, primary
-        app = IncrementalFlatlandPlan(self.env, None, optimize=self.optimize)
+        app = IncrementalFlatlandPlan(self.env, None, optimize=self.optimize, **self.plan_options)
         clingo_main(app, self.primary)
         self.stats = app.stats
         self.model = app.model
+        self.actions = app.action_list
         return(app.action_list)
 
-    def provide_context(self, actions, timestep, malfunctions) -> str:
-        """ provide additional facts when updating list """
+    def provide_context(self, actions, timestep, malfunctions) -> list:
+        """ provide assumptions when updating list """
         # actions that have already been executed
         # wait actions that are enforced because of malfunctions
-        # future actions that were previously planned
-        past = convert_formers_to_clingo(actions[:timestep])
-        present = convert_malfunctions_to_clingo(malfunctions, timestep)
-        future = convert_futures_to_clingo(actions[timestep:])
-        return(past + present + future)
+        past = convert_formers_to_assumptions(actions[:timestep])
+        present = convert_malfunctions_to_assumptions(malfunctions, timestep)
+        return(past + present)
 
     def update_actions(self, context) -> list:
         """ update list of actions following malfunction """
-        # pass env, secondary, context
-        app = FlatlandPlan(self.env, context)
-        clingo_main(app, self.primary)
-        return(app.action_list)
+        # the replanner keeps its control object, so the environment is only grounded once per simulation
+        if self.replanner is None:
+            options = {k: v for k, v in self.plan_options.items() if k in REPLAN_OPTIONS}
+            self.replanner = FlatlandReplan(self.env, self.primary, incremental=True, warm_start=self.warm_start, **options)
+        actions = self.replanner.replan(context, horizon=len(self.actions), hints=self.actions)
+        if actions is None:
+            warnings.warn('Replanning failed, continuing with the previous list of actions.')
+            return(self.actions)
+        self.model = self.replanner.model
+        self.actions = actions
+        return(actions)
 
 
 class SimulationManager():
-    def __init__(self,env,primary,secondary=None):
+    def __init__(self,env,primary,secondary=None,plan_options=None,warm_start=None):
         self.env = env
         self.primary = primary
         if secondary is None:
             self.secondary = primary 
         else:
             self.secondary = secondary
+        self.plan_options = plan_options if plan_options is not None else {}
+        self.warm_start = warm_start
         self.model = None
         self.stats = None
+        self.actions = None
+        self.replanner = None
 
     def build_actions(self) -> list:
         """ create initial list of actions """
         # pass env, primary
-        app = FlatlandPlan(self.env, None)
+        app = FlatlandPlan(self.env, None, **self.plan_options)
         clingo_main(app, self.primary)
         self.stats = app.stats
         self.model = app.model
+        self.actions = app.action_list
         return(app.action_list)
 
-    def provide_context(self, actions, timestep, malfunctions) -> str:
-        """ provide additional facts when updating list """
+    def provide_context(self, actions, timestep, malfunctions) -> list:
+        """ provide assumptions when updating list """
         # actions that have already been executed
         # wait actions that are enforced because of malfunctions
-        # future actions that were previously planned
-        past = convert_formers_to_clingo(actions[:timestep])
-        present = convert_malfunctions_to_clingo(malfunctions, timestep)
-        future = convert_futures_to_clingo(actions[timestep:])
-        return(past + present + future)
+        past = convert_formers_to_assumptions(actions[:timestep])
+        present = convert_malfunctions_to_assumptions(malfunctions, timestep)
+        return(past + present)
 
     def update_actions(self, context) -> list:
         """ update list of actions following malfunction """
-        # pass env, secondary, context
-        app = FlatlandPlan(self.env, context)
-        clingo_main(app, self.primary)
-        return(app.action_list)
+        # the replanner keeps its control object, so the environment is only grounded once per simulation
+        if self.replanner is None:
+            options = {k: v for k, v in self.plan_options.items() if k in REPLAN_OPTIONS}
+            self.replanner = FlatlandReplan(self.env, self.primary, incremental=False, warm_start=self.warm_start, **options)
+        actions = self.replanner.replan(context, horizon=len(self.actions), hints=self.actions)
+        if actions is None:
+            warnings.warn('Replanning failed, continuing with the previous list of actions.')
+            return(self.actions)
+        self.model = self.replanner.model
+        self.actions = actions
+        return(actions)
+
+
+class PortfolioSimulationManager():
+    def __init__(self, env, members, timeout=None, plan_options=None, warm_start=None):
+        self.env = env
+        self.members = members
+        self.timeout = timeout
+        # keyword arguments passed on to the replanner, on top of those of the winning member
+        self.plan_options = plan_options if plan_options is not None else {}
+        self.winner = None
+        self.warm_start = warm_start
+        self.model = None
+        self.stats = None
+        self.actions = None
+        self.replanner = None
+
+    def build_actions(self) -> list:
+        """ create initial list of actions with the first portfolio member that finds a valid plan """
+        winner, results = run_portfolio(self.env, self.members, timeout=self.timeout)
+        if winner is None:
+            raise Exception(f"No portfolio member found a valid plan: {results}")
+        name, _, _, actions, stats, model = winner
+        self.winner = next(m for m in self.members if m["name"] == name)
+        print(f"Portfolio winner: {name}")
+        self.stats = {"portfolio": {"winner": name, "members": results}, "winner": stats}
+        self.model = model
+        self.actions = actions
+        return(actions)
+
+    def provide_context(self, actions, timestep, malfunctions) -> list:
+        """ provide assumptions when updating list """
+        past = convert_formers_to_assumptions(actions[:timestep])
+        present = convert_malfunctions_to_assumptions(malfunctions, timestep)
+        return(past + present)
+
+    def update_actions(self, context) -> list:
+        """ update list of actions following malfunction, with the encodings of the winning member """
+        if self.replanner is None:
+            options = dict(self.plan_options, **{k: v for k, v in self.winner.get("plan_options", {}).items() if k in REPLAN_OPTIONS})
+            self.replanner = FlatlandReplan(self.env, self.winner["primary"], incremental=self.winner.get("incremental", True), warm_start=self.warm_start, **options)
+        actions = self.replanner.replan(context, horizon=len(self.actions), hints=self.actions)
+        if actions is None:
+            warnings.warn('Replanning failed, continuing with the previous list of actions.')
+            return(self.actions)
+        self.model = self.replanner.model
+        self.actions = actions
+        return(actions)
+
+
+class PrioritizedSimulationManager():
+    def __init__(self, env, primary, group_size=1, incremental=True, max_restarts=5, plan_options=None, warm_start=None):
+        self.env = env
+        self.primary = primary
+        self.group_size = group_size
+        self.incremental = incremental
+        self.max_restarts = max_restarts
+        self.plan_options = plan_options if plan_options is not None else {}
+        self.warm_start = warm_start
+        self.model = None
+        self.stats = None
+        self.actions = None
+        self.replanner = None
+
+    def build_actions(self) -> list:
+        """ create initial list of actions by planning the trains in groups of decreasing priority """
+        planner = PrioritizedPlan(self.env, self.primary, group_size=self.group_size, incremental=self.incremental,
+                                  max_restarts=self.max_restarts, plan_options=self.plan_options)
+        actions = planner.plan()
+        if actions is None:
+            raise Exception(f"Prioritized planning did not find a plan after {planner.stats['restarts']} restarts.")
+        self.stats = {"prioritized": planner.stats}
+        self.model = planner.model
+        self.actions = actions
+        return(actions)
+
+    def provide_context(self, actions, timestep, malfunctions) -> list:
+        """ provide assumptions when updating list """
+        past = convert_formers_to_assumptions(actions[:timestep])
+        present = convert_malfunctions_to_assumptions(malfunctions, timestep)
+        return(past + present)
+
+    def update_actions(self, context) -> list:
+        """ update list of actions following malfunction, all trains are replanned jointly """
+        if self.replanner is None:
+            options = {k: v for k, v in self.plan_options.items() if k in REPLAN_OPTIONS}
+            self.replanner = FlatlandReplan(self.env, self.primary, incremental=self.incremental, warm_start=self.warm_start, **options)
+        actions = self.replanner.replan(context, horizon=len(self.actions), hints=self.actions)
+        if actions is None:
+            warnings.warn('Replanning failed, continuing with the previous list of actions.')
+            return(self.actions)
+        self.model = self.replanner.model
+        self.actions = actions
+        return(actions)
+
+
+class ConflictBasedSimulationManager(PrioritizedSimulationManager):
+    def __init__(self, env, primary, incremental=True, max_nodes=200, plan_options=None, warm_start=None):
+        super().__init__(env, primary, incremental=incremental, plan_options=plan_options, warm_start=warm_start)
+        self.max_nodes = max_nodes
+
+    def build_actions(self) -> list:
+        """ create initial list of actions by planning every train on its own and resolving their conflicts """
+        planner = ConflictBasedPlan(self.env, self.primary, incremental=self.incremental, max_nodes=self.max_nodes, plan_options=self.plan_options)
+        actions = planner.plan()
+        if actions is None:
+            raise Exception(f"Conflict-based search did not find a plan after expanding {planner.stats['nodes']} nodes.")
+        self.stats = {"cbs": planner.stats}
+        self.model = planner.model
+        self.actions = actions
+        return(actions)
+
+
+class RollingSimulationManager():
+    def __init__(self, env, window=32, commit=8, budget=None, plan_options=None):
+        plan_options = plan_options if plan_options is not None else {}
+        self.env = env
+        self.commit = commit
+        self.planner = RollingPlan(env, window=window, commit=commit, budget=budget, wait=plan_options.get("precomputed_conn") or "always",
+                                   cache=plan_options.get("cache"), threads=plan_options.get("threads"), parallel_mode=plan_options.get("parallel_mode", "compete"))
+        self.model = None
+        self.stats = None
+        self.actions = None
+
+    def build_actions(self) -> list:
+        """ plan the first window and commit its first steps """
+        window = self.planner.plan_window(0)
+        if window is None:
+            raise Exception("No plan found for the first window.")
+        self.stats = {"windows": self.planner.stats}
+        self.model = self.planner.model
+        self.actions = window[:self.commit]
+        return(self.actions)
+
+    def provide_context(self, actions, timestep, malfunctions) -> int:
+        """ the next window starts after the current timestep, the malfunctions are part of the state of the environment """
+        return(timestep + 1)
+
+    def update_actions(self, start) -> list:
+        """ plan a new window from the current state of the environment and replace all actions from global timestep `start` on """
+        window = self.planner.plan_window(start)
+        if window is None:
+            warnings.warn('Planning the next window failed, continuing with the previous list of actions.')
+            return(self.actions)
+        self.model = self.planner.model
+        self.actions = append_actions(self.actions, window, start, self.commit)
+        return(self.actions)
+
+
+class LocalRepairSimulationManager():
+    def __init__(self, base, primary, incremental=True, warm_start=None, plan_options=None):
+        # the manager that plans the initial actions, and replans all trains if a local repair fails
+        self.base = base
+        self.primary = primary
+        self.incremental = incremental
+        self.warm_start = warm_start
+        self.plan_options = plan_options if plan_options is not None else {}
+        self.repair = None
+        # trains whose current malfunction has already been repaired
+        self.handled = set()
+        self.model = None
+        self.stats = None
+        self.actions = None
+
+    def build_actions(self) -> list:
+        """ create initial list of actions with the base manager """
+        actions = self.base.build_actions()
+        self.model = self.base.model
+        self.actions = actions
+        options = {k: v for k, v in self.plan_options.items() if k in REPLAN_OPTIONS}
+        self.repair = LocalRepair(self.base.env, self.primary, self.model, incremental=self.incremental, warm_start=self.warm_start, plan_options=options)
+        if not self.repair.occupied:
+            warnings.warn('The plan has no occupies/3 or occupied/3 atoms, all trains are replanned after malfunctions.')
+            self.repair = None
+        self.stats = {"plan": self.base.stats, "local_repairs": self.repair.stats if self.repair is not None else []}
+        return(actions)
+
+    def provide_context(self, actions, timestep, malfunctions) -> tuple:
+        """ the new malfunctions for the local repair, and the assumptions of the base manager in case it fails """
+        broken = {train: duration for train, duration in malfunctions if train not in self.handled}
+        self.handled = {train for train, _ in malfunctions}
+        return(actions, timestep, malfunctions, broken, self.base.provide_context(actions, timestep, malfunctions))
+
+    def update_actions(self, context) -> list:
+        """ replan the trains affected by the new malfunctions, or all trains if that fails """
+        actions, timestep, malfunctions, broken, assumptions = context
+        if self.repair is not None and broken:
+            repaired = self.repair.repair(actions, timestep, malfunctions, broken)
+            if repaired is not None:
+                self.model = self.repair.model
+                # the base manager replans from (and warm starts with) the repaired plan if a later repair fails
+                self.actions = self.base.actions = repaired
+                return(repaired)
+            warnings.warn('Local repair failed, replanning all trains.')
+        self.actions = self.base.update_actions(assumptions)
+        self.model = self.base.model
+        if self.repair is not None:
+            self.repair.occupied = occupancy(self.model)
+        return(self.actions)
 
 
 class OutputLogManager():
@@ -193,7 +419,40 @@ def get_args():
     parser.add_argument('-e', '--env', type=str, default='', nargs=1, help='the Flatland environment ID')
     parser.add_argument('-i', '--incremental', action='store_true', default=False, help='if included, use the incremental solving approach')
     parser.add_argument('-io', '--incremental-optimize', action='store_true', default=False, help='if included, after establishing the minimum time horizon, run the \'optimize\' subprogram')
+    parser.add_argument('--opt-budget', type=float, default=None, help='seconds after which the optimization stops and keeps the best plan found so far')
+    parser.add_argument('--opt-patience', type=float, default=None, help='seconds without a cost improvement after which the optimization stops and keeps the best plan found so far')
+    parser.add_argument('--step-log', type=str, default=None, help='JSONL file to which compact statistics of every incremental step are written as soon as the step is solved')
+    parser.add_argument('--full-stats', action='store_true', default=False, help='if included, keep the full clingo statistics of every incremental step in memory')
+    parser.add_argument('--solve-mode', type=str, choices=SOLVE_MODES, default='optimal', help='without -i: stop at the first model, solve for the optimal one, or enumerate up to --max-models models')
+    parser.add_argument('--max-models', type=int, default=0, help='number of models enumerated with --solve-mode enumerate (0 for all), only the last one is kept')
+    parser.add_argument('--extract', type=str, nargs='+', default=['atoms'], help='symbols kept from the model: atoms, shown, or signatures such as action/3 seg_transition/4 (the plan needs action/3, and seg_transition/4 with --segments)')
     parser.add_argument('--no-render', action='store_true', default=True, help='if included, run the Flatland simulation but do not render a GIF')
+    parser.add_argument('--fact-loader', type=str, choices=FACT_LOADERS, default='backend', help='how environment facts are passed to clingo: as symbols via the backend, or as parsed text')
+    parser.add_argument('--precomputed-conn', type=str, choices=WAIT_POLICIES, default=None, help='compute the cell_conn/5 facts in Python with the given wait policy (use with asp/tk/tracks_precomputed.lp)')
+    parser.add_argument('--segments', action='store_true', default=False, help='if included, contract corridors into segments and plan on them (use with asp/tk/encoding_segments.lp)')
+    parser.add_argument('--reachability', type=str, choices=DEADLINES, default=None, help='add per-train reachability windows with the given deadline (use with asp/tk/encoding_incremental_reach.lp or asp/tk/speed_revamp_reach.lp)')
+    parser.add_argument('--cache-dir', type=str, default=None, help='directory in which derived facts and tables are cached across runs (by default they are only cached in memory)')
+    parser.add_argument('--cache-size', type=int, default=256, help='maximum size of the cache directory in MB, least recently used environments are evicted first')
+    parser.add_argument('--ground-cache', type=str, default=None, help='directory in which ground base programs are saved in aspif format and loaded from on later runs')
+    parser.add_argument('--propagator', action='store_true', default=False, help='if included, check collisions with a propagator instead of the grounded constraint (use with asp/tk/encoding_incremental_propagator.lp)')
+    parser.add_argument('--warm-start', type=str, choices=WARM_STARTS, default=None, help='after a malfunction, prefer the actions of the previous plan when replanning: as sign heuristics, or also deciding on them first (level)')
+    parser.add_argument('--local-repair', action='store_true', default=False, help='if included, replan only the trains whose plans clash with a malfunctioning train and keep all other plans (use with an encoding that defines occupies/3)')
+    parser.add_argument('--lower-bound', action='store_true', default=False, help='if included, start the incremental loop at a lower bound on the makespan (shortest paths of all trains)')
+    parser.add_argument('--horizon', type=str, choices=HORIZON_STRATEGIES, default='linear', help='how the incremental loop searches for the first satisfiable step')
+    parser.add_argument('--horizon-step', type=int, default=8, help='first gap between probed steps for the exponential and binary horizon strategies')
+    parser.add_argument('--portfolio', action='store_true', default=False, help='if included, run all members of params.portfolio in parallel and keep the first valid plan')
+    parser.add_argument('--portfolio-timeout', type=float, default=None, help='seconds after which all portfolio members are cancelled')
+    parser.add_argument('--prioritized', action='store_true', default=False, help='if included, plan the trains in groups by priority, each group avoiding the cells of the earlier ones (use with an encoding that defines occupies/3)')
+    parser.add_argument('--group-size', type=int, default=1, help='number of trains planned together with --prioritized')
+    parser.add_argument('--max-restarts', type=int, default=5, help='how often --prioritized restarts with a failed group first')
+    parser.add_argument('--cbs', action='store_true', default=False, help='if included, plan every train on its own and resolve conflicts with conflict-based search (use with an encoding that defines occupies/3)')
+    parser.add_argument('--max-nodes', type=int, default=200, help='number of conflict-based search nodes expanded before giving up')
+    parser.add_argument('--rolling', action='store_true', default=False, help='if included, plan --window timesteps ahead from the current state, commit the first --commit of them and plan again (uses asp/tk/encoding_rolling.lp)')
+    parser.add_argument('--window', type=int, default=32, help='number of timesteps planned ahead with --rolling')
+    parser.add_argument('--commit', type=int, default=8, help='number of timesteps of each window that are executed with --rolling before planning the next one')
+    parser.add_argument('--window-budget', type=float, default=None, help='seconds after which the optimization of a window stops and keeps the best plan found so far')
+    parser.add_argument('-t', '--threads', type=int, default=getattr(params, 'threads', None), help='number of solver threads (defaults to params.threads)')
+    parser.add_argument('--parallel-mode', type=str, choices=PARALLEL_MODES, default=getattr(params, 'parallel_mode', 'compete'), help='whether solver threads compete on or split the search space (defaults to params.parallel_mode)')
     return(parser.parse_args())
 
 
@@ -212,7 +471,9 @@ def main():
     # dev test main
     if check_params(params):
         args: Namespace = get_args()
-        env = load_env(args.env[0])
+        tracer.enable()
+        with span("load env", env=args.env[0]):
+            env = load_env(args.env[0])
         no_render = args.no_render
         env_name = args.env[0]
         if env_name.startswith("envs/pkl/"):
@@ -221,14 +482,36 @@ def main():
             env_name = env_name[:-4]
         incremental = args.incremental
         optimize = args.incremental_optimize
+        plan_options = {"fact_loader": args.fact_loader, "precomputed_conn": args.precomputed_conn, "segments": args.segments, "reachability": args.reachability,
+                        "cache": FactCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024),
+                        "ground_cache": GroundProgramCache(args.ground_cache) if args.ground_cache else None,
+                        "threads": args.threads, "parallel_mode": args.parallel_mode, "propagator": args.propagator,
+                        "extract": args.extract[0] if args.extract in (["atoms"], ["shown"]) else args.extract}
 
     start_time = time.time()
     # create manager objects
     mal = MalfunctionManager(env.get_num_agents())
-    if not incremental and not optimize:
-        sim = SimulationManager(env, params.primary, params.secondary)
+    if args.portfolio:
+        sim = PortfolioSimulationManager(env, params.portfolio, timeout=args.portfolio_timeout, plan_options=plan_options, warm_start=args.warm_start)
+    elif args.rolling:
+        sim = RollingSimulationManager(env, window=args.window, commit=args.commit, budget=args.window_budget, plan_options=plan_options)
+    elif args.prioritized or args.cbs:
+        options = dict(plan_options, lower_bound=args.lower_bound, horizon=args.horizon, horizon_step=args.horizon_step) if incremental else plan_options
+        if args.cbs:
+            sim = ConflictBasedSimulationManager(env, params.primary, incremental=incremental, max_nodes=args.max_nodes, plan_options=options, warm_start=args.warm_start)
+        else:
+            sim = PrioritizedSimulationManager(env, params.primary, group_size=args.group_size, incremental=incremental, max_restarts=args.max_restarts, plan_options=options, warm_start=args.warm_start)
+    elif not incremental and not optimize:
+        sim = SimulationManager(env, params.primary, params.secondary, plan_options=dict(plan_options, solve_mode=args.solve_mode, max_models=args.max_models), warm_start=args.warm_start)
     else:
-        sim = IncrementalSimulationManager(env, params.primary, params.secondary, optimize=optimize)
+        sim = IncrementalSimulationManager(env, params.primary, params.secondary, optimize=optimize, plan_options=dict(plan_options, lower_bound=args.lower_bound, horizon=args.horizon, horizon_step=args.horizon_step,
+                                                                                                                   opt_budget=args.opt_budget, opt_patience=args.opt_patience,
+                                                                                                                   step_log=args.step_log, full_stats=args.full_stats), warm_start=args.warm_start)
+    if args.local_repair:
+        if args.portfolio or args.rolling:
+            warnings.warn('--local-repair is ignored with --portfolio and --rolling.')
+        else:
+            sim = LocalRepairSimulationManager(sim, params.primary, incremental=incremental or optimize, warm_start=args.warm_start, plan_options=plan_options)
     log = OutputLogManager()
 
     # envrionment rendering
@@ -245,7 +528,8 @@ def main():
     state_map = {0:'waiting', 1:'ready to depart', 2:'malfunction (off map)', 3:'moving', 4:'stopped', 5:'malfunction (on map)', 6:'done'}
     dir_map = {0:'n', 1:'e', 2:'s', 3:'w'}
 
-    actions = sim.build_actions()
+    with span("plan"):
+        actions = sim.build_actions()
 
     train_dict = train_info(env)
 
@@ -269,7 +553,8 @@ def main():
             #     print(f"WARNING: At timestep {timestep}, agent {a} is STOPPED but action is {action_map[actions[timestep][a]]}.")
             #     logger.warning(f"At timestep {timestep}, agent {a} is STOPPED but action is {action_map[actions[timestep][a]]}.")
 
-        _, _, done, info = env.step(actions[timestep])
+        with span("env.step", timestep=timestep):
+            _, _, done, info = env.step(actions[timestep])
 
         # end if simulation is finished
         if done['__all__'] and timestep < len(actions)-1:
@@ -280,45 +565,52 @@ def main():
         new_malfs = mal.check(info)
 
         if len(new_malfs) > 0:
-            context = sim.provide_context(actions, timestep, mal.get())
-            actions = sim.update_actions(context)
+            with span("replan", timestep=timestep, trains=sorted(new_malfs)):
+                context = sim.provide_context(actions, timestep, mal.get())
+                actions = sim.update_actions(context)
 
         mal.deduct() #??? where in the loop should this go - before context?
+
+        # rolling horizon: plan the next window from the current state once the committed steps are used up
+        if args.rolling and timestep + 1 == len(actions) and timestep + 1 < env._max_episode_steps:
+            with span("plan window", timestep=timestep + 1):
+                actions = sim.update_actions(timestep + 1)
         
         # render an image
         filename = 'tmp/frames/flatland_frame_{:04d}.png'.format(timestep)
         if env_renderer is not None:
-            env_renderer.render_env(show=True, show_observations=False, show_predictions=False)
-            env_renderer.gl.save_image(filename)
-            env_renderer.reset()
-
-            # add red numbers in the corner
-            with Image.open(filename) as img:
-                draw = ImageDraw.Draw(img)
-                padding = 10
-                font_size = int(min(img.width, img.height) * 0.10)
-                try:
-                    font = ImageFont.truetype("modules/LiberationMono-Regular.ttf", font_size)
-                except IOError:
-                    font = ImageFont.load_default()
+            with span("render frame", timestep=timestep):
+                env_renderer.render_env(show=True, show_observations=False, show_predictions=False)
+                env_renderer.gl.save_image(filename)
+                env_renderer.reset()
+
+                # add red numbers in the corner
+                with Image.open(filename) as img:
+                    draw = ImageDraw.Draw(img)
+                    padding = 10
+                    font_size = int(min(img.width, img.height) * 0.10)
+                    try:
+                        font = ImageFont.truetype("modules/LiberationMono-Regular.ttf", font_size)
+                    except IOError:
+                        font = ImageFont.load_default()
                 
-                # prepare text
-                text = f"{timestep}"
-                size = font.getbbox(text)
-                text_width = size[2]-size[0]
-                text_position = (img.width - text_width - padding, padding)
+                    # prepare text
+                    text = f"{timestep}"
+                    size = font.getbbox(text)
+                    text_width = size[2]-size[0]
+                    text_position = (img.width - text_width - padding, padding)
                 
-                # draw text borders
-                x, y = text_position
-                border_color = "black"
-                for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]:
-                    draw.text((x + dx, y + dy), text, fill=border_color, font=font)
+                    # draw text borders
+                    x, y = text_position
+                    border_color = "black"
+                    for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]:
+                        draw.text((x + dx, y + dy), text, fill=border_color, font=font)
                 
-                # draw text
-                draw.text(text_position, text, fill="red", font=font)
-                img.save(filename)
+                    # draw text
+                    draw.text(text_position, text, fill="red", font=font)
+                    img.save(filename)
 
-            images.append(imageio.imread(filename))
+                images.append(imageio.imread(filename))
         # images.append(imageio.imread(filename))
         timestep = timestep + 1
 
@@ -328,7 +620,8 @@ def main():
     base_dir = f"output/{stamp}"
     # combine images into gif
     if not no_render:
-        imageio.mimsave(f"output/{stamp}/animation.gif", images, format='GIF', loop=0, duration=240)
+        with span("gif"):
+            imageio.mimsave(f"output/{stamp}/animation.gif", images, format='GIF', loop=0, duration=240)
         gif_time = time.time() - gif_time
         print(f"GIF generated in {gif_time:.2f} seconds.")
 
@@ -353,6 +646,9 @@ def main():
         f.write("\nStatistics:\n")
         f.write(f"Simulation time: {sim_time:.2f}s\n")
         f.write(json.dumps(sim.stats, indent=4))
+        if getattr(sim, "replanner", None) is not None:
+            f.write("\n\nReplans:\n")
+            f.write(json.dumps(sim.replanner.stats, indent=4))
 
     # copy params.primary files to output folder
     os.makedirs(os.path.join(base_dir, "asp_files"), exist_ok=True)
@@ -373,13 +669,19 @@ def main():
     html_time = time.time()
     # whole animation should last 30s
     milliseconds_per_step = int(30000 / timestep)
-    landscape = LandscapeBuilder(base_dir, timestep, cell_size=20)
-    html_file = generate_html(env_name, landscape, milliseconds_per_step=milliseconds_per_step)
+    with span("LandscapeBuilder"):
+        landscape = LandscapeBuilder(base_dir, timestep, cell_size=20)
+    with span("generate_html"):
+        html_file = generate_html(env_name, landscape, milliseconds_per_step=milliseconds_per_step)
     with open(os.path.join(base_dir, "visualization.html"), "w") as f:
         f.write(html_file)
     html_time = time.time() - html_time
     print(f"HTML visualization generated in {html_time:.2f} seconds.")
 
+    # save the timing spans of this run
+    tracer.save(os.path.join(base_dir, "trace.json"))
+    print(f"Trace saved to {os.path.join(base_dir, 'trace.json')}.")
+
 if __name__ == "__main__":
     main()
     # path = "/Users/karlosswald/repositories/flatland/flatland_playground/flatland/output/env_015--14_7_1768843385.2267962"